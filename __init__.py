@@ -24,8 +24,16 @@
 #
 ############################################################################
 
+import time
 import bpy
+from bpy.app.handlers import persistent
+from bpy_extras import view3d_utils
+from bpy_extras.io_utils import ExportHelper, ImportHelper
 from . import adhere_object
+from . import caches
+from . import live_adhesion
+from . import placement_io
+from . import profiling
 
 
 bl_info = {
@@ -48,6 +56,8 @@ translation_dict = {
                 "Mesh To Adhere Not Selected",
             ("*", "Faces Of Mesh Not Selected"):
                 "Faces Of Mesh Not Selected",
+            ("*", "No Face Material Matches A Source"):
+                "No Face Material Matches A Source",
             ("*", "Mesh Select"):
                 "Mesh Select", 
             ("*", "Mesh Adhesion"):
@@ -64,16 +74,106 @@ translation_dict = {
                 "Offset Position:", 
             ("*", "Execute"):
                 "Execute", 
+            ("*", "Execute Mesh Adhesion In Steps"):
+                "Execute Mesh Adhesion In Steps",
+            ("*", "Create the copies a chunk at a time, press ESC to cancel"):
+                "Create the copies a chunk at a time, press ESC to cancel",
+            ("*", "Export Placements"):
+                "Export Placements",
+            ("*", "Write the placements of the copies to a file without creating them"):
+                "Write the placements of the copies to a file without creating them",
+            ("*", "Placements Exported"):
+                "Placements Exported",
+            ("*", "Import Placements"):
+                "Import Placements",
+            ("*", "Create copies of the source meshes from a placement file"):
+                "Create copies of the source meshes from a placement file",
+            ("*", "Source Mesh Not Found"):
+                "Source Mesh Not Found",
+            ("*", "Export"):
+                "Export",
+            ("*", "Import"):
+                "Import",
             ("*", "Center Of Selected Faces"):
                 "Center Of Selected Faces", 
             ("*", "Every Selected Faces"):
                 "Every Selected Faces",
+            ("*", "Project Onto Surface"):
+                "Project Onto Surface",
+            ("*", "Scatter Over Selected Faces"):
+                "Scatter Over Selected Faces",
+            ("*", "Per Island"):
+                "Per Island",
+            ("*", "Count"):
+                "Count",
+            ("*", "Seed"):
+                "Seed",
+            ("*", "Cull Overlapping Copies"):
+                "Cull Overlapping Copies",
+            ("*", "Minimum Spacing"):
+                "Minimum Spacing",
+            ("*", "Spacing between copies, 0 uses the bounding radius of the mesh"):
+                "Spacing between copies, 0 uses the bounding radius of the mesh",
+            ("*", "Overlapping Copies Culled"):
+                "Overlapping Copies Culled",
+            ("*", "Follow Target Edits"):
+                "Follow Target Edits",
+            ("*", "Orientation:"):
+                "Orientation:",
+            ("*", "Normal Only"):
+                "Normal Only",
+            ("*", "Longest Edge"):
+                "Longest Edge",
+            ("*", "First Edge"):
+                "First Edge",
+            ("*", "World X Axis"):
+                "World X Axis",
+            ("*", "World Y Axis"):
+                "World Y Axis",
+            ("*", "World Z Axis"):
+                "World Z Axis",
+            ("*", "Direction the X axis of the adhered mesh follows on each face"):
+                "Direction the X axis of the adhered mesh follows on each face",
+            ("*", "All Selected Objects"):
+                "All Selected Objects",
+            ("*", "Adhere to the selected faces of every selected mesh object"):
+                "Adhere to the selected faces of every selected mesh object",
+            ("*", "Source Group"):
+                "Source Group",
+            ("*", "Adhere the meshes of this group instead of the selected mesh"):
+                "Adhere the meshes of this group instead of the selected mesh",
+            ("*", "Round Robin"):
+                "Round Robin",
+            ("*", "Random"):
+                "Random",
+            ("*", "By Material"):
+                "By Material",
+            ("*", "Source Assignment"):
+                "Source Assignment",
+            ("*", "How each face chooses a mesh of the source group"):
+                "How each face chooses a mesh of the source group",
+            ("*", "Keep the copies on their faces while the target mesh is edited"):
+                "Keep the copies on their faces while the target mesh is edited",
+            ("*", "Report Phase Timings"):
+                "Report Phase Timings",
+            ("*", "Timing Log"):
+                "Timing Log",
+            ("*", "Append the timings of each run to this JSON lines file"):
+                "Append the timings of each run to this JSON lines file",
+            ("*", "Adhesion Time"):
+                "Adhesion Time",
+            ("*", "Peak Memory"):
+                "Peak Memory",
             ("*", "Select To Type Of Adhesion"):
                 "Select To Type Of Adhesion",
             ("*", "Copy"):
                 "Copy", 
             ("*", "Linked"):
-                "Linked" 
+                "Linked",
+            ("*", "Instanced"):
+                "Instanced",
+            ("*", "Merged"):
+                "Merged"
                 },
         "ja_JP":{
             ("*", "Execute Mesh Adhesion"):
@@ -82,6 +182,8 @@ translation_dict = {
                 "選択メッシュの面が選択されていません",
             ("*", "Faces Of Mesh Not Selected"):
                 "元のメッシュの面が選択されていません",
+            ("*", "No Face Material Matches A Source"):
+                "接着メッシュと一致するマテリアルの面がありません",
             ("*", "Mesh Select"):
                 "オブジェクト選択", 
             ("*", "Mesh Adhesion"):
@@ -98,16 +200,106 @@ translation_dict = {
                 "オフセット座標:", 
             ("*", "Execute"):
                 "実行", 
+            ("*", "Execute Mesh Adhesion In Steps"):
+                "オブジェクト接着を分割して実行",
+            ("*", "Create the copies a chunk at a time, press ESC to cancel"):
+                "複製を少しずつ作成、ESCでキャンセル",
+            ("*", "Export Placements"):
+                "配置をエクスポート",
+            ("*", "Write the placements of the copies to a file without creating them"):
+                "複製を作成せずに配置をファイルに書き出す",
+            ("*", "Placements Exported"):
+                "エクスポートした配置",
+            ("*", "Import Placements"):
+                "配置をインポート",
+            ("*", "Create copies of the source meshes from a placement file"):
+                "配置ファイルから接着メッシュの複製を作成",
+            ("*", "Source Mesh Not Found"):
+                "接着メッシュが見つかりません",
+            ("*", "Export"):
+                "エクスポート",
+            ("*", "Import"):
+                "インポート",
             ("*", "Center Of Selected Faces"):
                 "選択面の中心に接着", 
             ("*", "Every Selected Faces"):
                 "各選択面毎に接着",
+            ("*", "Project Onto Surface"):
+                "表面に投影して接着",
+            ("*", "Scatter Over Selected Faces"):
+                "選択面上に散布",
+            ("*", "Per Island"):
+                "つながった選択面毎に接着",
+            ("*", "Count"):
+                "個数",
+            ("*", "Seed"):
+                "シード",
+            ("*", "Cull Overlapping Copies"):
+                "重なる複製を除去",
+            ("*", "Minimum Spacing"):
+                "最小間隔",
+            ("*", "Spacing between copies, 0 uses the bounding radius of the mesh"):
+                "複製間の最小間隔、0の場合はメッシュの外接半径",
+            ("*", "Overlapping Copies Culled"):
+                "除去された重なる複製",
+            ("*", "Follow Target Edits"):
+                "元のメッシュの編集に追従",
+            ("*", "Orientation:"):
+                "向き:",
+            ("*", "Normal Only"):
+                "法線のみ",
+            ("*", "Longest Edge"):
+                "最長の辺",
+            ("*", "First Edge"):
+                "最初の辺",
+            ("*", "World X Axis"):
+                "ワールドX軸",
+            ("*", "World Y Axis"):
+                "ワールドY軸",
+            ("*", "World Z Axis"):
+                "ワールドZ軸",
+            ("*", "Direction the X axis of the adhered mesh follows on each face"):
+                "各面で接着メッシュのX軸を合わせる方向",
+            ("*", "All Selected Objects"):
+                "選択中の全オブジェクト",
+            ("*", "Adhere to the selected faces of every selected mesh object"):
+                "選択中の全メッシュオブジェクトの選択面に接着",
+            ("*", "Source Group"):
+                "接着グループ",
+            ("*", "Adhere the meshes of this group instead of the selected mesh"):
+                "選択メッシュの代わりにこのグループのメッシュを接着",
+            ("*", "Round Robin"):
+                "順番",
+            ("*", "Random"):
+                "ランダム",
+            ("*", "By Material"):
+                "マテリアル毎",
+            ("*", "Source Assignment"):
+                "接着メッシュの割り当て",
+            ("*", "How each face chooses a mesh of the source group"):
+                "各面に接着するグループ内メッシュの選び方",
+            ("*", "Keep the copies on their faces while the target mesh is edited"):
+                "元のメッシュの編集中も複製を各面に接着し続ける",
+            ("*", "Report Phase Timings"):
+                "処理時間を表示",
+            ("*", "Timing Log"):
+                "処理時間ログ",
+            ("*", "Append the timings of each run to this JSON lines file"):
+                "実行毎の処理時間をこのJSON Linesファイルに追記",
+            ("*", "Adhesion Time"):
+                "接着処理時間",
+            ("*", "Peak Memory"):
+                "最大メモリ使用量",
             ("*", "Select To Type Of Adhesion"):
                 "接着方法の選択",
             ("*", "Copy"):
                 "コピー", 
             ("*", "Linked"):
-                "参照"
+                "参照",
+            ("*", "Instanced"):
+                "インスタンス",
+            ("*", "Merged"):
+                "結合"
                 }
         }
 
@@ -120,25 +312,61 @@ class MeshSearchProps(bpy.types.PropertyGroup):
     
     mesh_list = bpy.props.CollectionProperty(type=bpy.types.PropertyGroup)
     sel_mesh = bpy.props.StringProperty()
+    list_hash = bpy.props.IntProperty()
 
-    def update_data(self):
-        sel_mesh_exist = False
+    # Names shared by every redraw until objects are added, removed or
+    # renamed, or another file is loaded
+    list_dirty = True
+    list_fingerprint = None
+    mesh_names = []
+    mesh_name_set = set()
+    mesh_names_hash = 0
 
-        self.mesh_list.clear()
-        for obj in bpy.context.scene.objects:
-            if obj.type == 'MESH':
+    def update_data(self):
+        scene = bpy.context.scene
+        # keys() lists the names of every object in one call, so added,
+        # removed and renamed objects all change the fingerprint
+        fingerprint = (scene.name, len(scene.objects), bpy.data.objects.keys())
+
+        if MeshSearchProps.list_dirty or fingerprint != MeshSearchProps.list_fingerprint:
+            MeshSearchProps.list_dirty = False
+            MeshSearchProps.list_fingerprint = fingerprint
+            mesh_names = [obj.name for obj in scene.objects if obj.type == 'MESH']
+            if mesh_names != MeshSearchProps.mesh_names:
+                MeshSearchProps.mesh_names = mesh_names
+                MeshSearchProps.mesh_name_set = set(mesh_names)
+                MeshSearchProps.mesh_names_hash = hash(tuple(mesh_names)) & 0x7fffffff
+
+        # Rewrite the list only when it differs from the cached names
+        if self.list_hash != MeshSearchProps.mesh_names_hash or \
+           len(self.mesh_list) != len(MeshSearchProps.mesh_names):
+            self.mesh_list.clear()
+            for name in MeshSearchProps.mesh_names:
                 val = self.mesh_list.add()
-                val.name = obj.name
-        
-        for mesh in self.mesh_list:
-            if mesh.name == self.sel_mesh:
-                sel_mesh_exist = True
-                break
+                val.name = name
+            self.list_hash = MeshSearchProps.mesh_names_hash
 
-        if sel_mesh_exist == False:
+        if self.sel_mesh != "" and self.sel_mesh not in MeshSearchProps.mesh_name_set:
             self.sel_mesh = ""
 
 
+@persistent
+def scene_update_post(scene):
+    caches.sceneUpdate()
+    live_adhesion.sceneUpdate()
+
+
+@persistent
+def load_file(dummy):
+    # Links and caches are keyed by names of the file that was open, so
+    # they are dropped before and after another file is loaded
+    live_adhesion.clear()
+    caches.bvh_cache.clear()
+    caches.source_cache.clear()
+    caches.scene_ray_index.dirty = True
+    MeshSearchProps.list_dirty = True
+
+
 class AdhereObject(bpy.types.Operator):
     bl_idname  = "object.adhere_object"
     bl_label = getTransText("Execute Mesh Adhesion")
@@ -148,26 +376,106 @@ class AdhereObject(bpy.types.Operator):
 
     def execute(self, context):
         wm = context.window_manager
+        aobj = self.startAdhesion(context, None)
+        if(AdhereObject.ret_val != 0):
+            return wm.invoke_popup(self, width=250, height=100)
+
+        return self.finishAdhesion(context, aobj)
+
+    def startAdhesion(self, context, chunk_size, copy_option=None):
         scene = context.scene
         mcollection = context.window_manager.mesh_collection
         
-        adh_obj = bpy.data.objects[mcollection.sel_mesh] 
-        org_obj = bpy.context.active_object
-        offset = (scene.offset_x, scene.offset_y, scene.offset_z)
-
+        self.adh_obj = bpy.data.objects.get(mcollection.sel_mesh)
+        self.org_obj = bpy.context.active_object
+        self.offset = (scene.offset_x, scene.offset_y, scene.offset_z)
+        adh_obj = self.adh_obj
+        org_obj = self.org_obj
+        offset = self.offset
+
+        # Sources of a group and targets of all selected objects, the group
+        # field is only shown for Every Selected Faces
+        adh_objs = [adh_obj] if adh_obj is not None else []
+        source_group = None
+        if scene.adhere_option == "MULTIPLE":
+            source_group = bpy.data.groups.get(scene.source_group)
+        if source_group is not None:
+            adh_objs = [obj for obj in source_group.objects if obj.type == 'MESH']
+        org_objs = [org_obj]
+        if scene.multi_target:
+            org_objs += [obj for obj in context.selected_objects
+                         if obj.type == 'MESH' and obj != org_obj and obj not in adh_objs]
+        self.is_multi = scene.adhere_option == "MULTIPLE" and \
+            (source_group is not None or len(org_objs) > 1)
+
+        if copy_option is None:
+            copy_option = scene.objcopy_option
+
+        profiling.resetPeakRss()
         aobj = adhere_object.AdhereProc()
-        if(scene.adhere_option == "SINGLE"):
+        aobj.chunk_size = chunk_size
+        if copy_option == "NONE" or (scene.adhere_option == "MULTIPLE" and scene.live_adhesion):
+            aobj.placement_log = []
+        if scene.adhere_option == "MULTIPLE":
+            aobj.orient_option = scene.orient_option
+        if scene.cull_overlap and scene.adhere_option in ("MULTIPLE", "ISLAND", "SCATTER"):
+            aobj.cull_spacing = scene.cull_spacing
+        if scene.profile_phases:
+            aobj.profiler = profiling.PhaseProfiler(bpy.path.abspath(scene.profile_log))
+        if len(adh_objs) == 0 or (adh_obj is None and not self.is_multi):
+            AdhereObject.ret_val = -2
+        elif self.is_multi:
+            AdhereObject.ret_val = aobj.execMultiAdhesion(org_objs, adh_objs, offset,
+                                                          copy_option,
+                                                          scene.source_assign,
+                                                          scene.scatter_seed)
+        elif(scene.adhere_option == "SINGLE"):
             AdhereObject.ret_val = aobj.execSingleAdhesion(org_obj, adh_obj, offset)
+        elif(scene.adhere_option == "PROJECT"):
+            AdhereObject.ret_val = aobj.execProjectAdhesion(org_obj, adh_obj, offset)
+        elif(scene.adhere_option == "ISLAND"):
+            AdhereObject.ret_val = aobj.execIslandAdhesion(org_obj, adh_obj, offset,
+                                                           copy_option)
+        elif(scene.adhere_option == "SCATTER"):
+            AdhereObject.ret_val = aobj.execScatterAdhesion(org_obj, adh_obj, offset,
+                                                            copy_option,
+                                                            scene.scatter_count,
+                                                            scene.scatter_seed)
         else:
-            link = False
-            if(scene.objcopy_option == "REFERENCE"):
-                link = True
-            AdhereObject.ret_val = aobj.execMultipleAdhesion(org_obj, adh_obj, offset, link)
+            AdhereObject.ret_val = aobj.execMultipleAdhesion(org_obj, adh_obj, offset,
+                                                             copy_option)
+
         if(AdhereObject.ret_val != 0):
-            return wm.invoke_popup(self, width=250, height=100)
+            self.writeProfile(context, aobj)
+        return aobj
+
+    def finishAdhesion(self, context, aobj):
+        scene = context.scene
+        self.writeProfile(context, aobj)
+
+        if scene.adhere_option == "MULTIPLE" and scene.live_adhesion and not self.is_multi:
+            live_adhesion.addLink(self.org_obj, self.adh_obj, aobj, self.offset)
+
+        if aobj.culled_num > 0:
+            self.report({'INFO'}, "%s: %d" % (getTransText("Overlapping Copies Culled"),
+                                              aobj.culled_num))
+        # The timing summary already holds the peak memory of the run
+        if aobj.profiler.enabled:
+            self.report({'INFO'}, "%s: %.3fs (%s)" % (getTransText("Adhesion Time"),
+                                                      aobj.profiler.totalSeconds(),
+                                                      aobj.profiler.summary()))
+        else:
+            self.report({'INFO'}, "%s: %s" % (getTransText("Peak Memory"),
+                                              profiling.formatBytes(profiling.peakRss())))
 
         return {'FINISHED'}
 
+    def writeProfile(self, context, aobj):
+        if aobj.profiler.enabled:
+            aobj.profiler.writeLog(adhere_option=context.scene.adhere_option,
+                                   objcopy_option=context.scene.objcopy_option,
+                                   result=AdhereObject.ret_val)
+
     # Popup Message
     def draw(self, context):
         layout = self.layout
@@ -175,10 +483,143 @@ class AdhereObject(bpy.types.Operator):
             layout.label(getTransText("Mesh To Adhere Not Selected"), icon = 'ERROR')
         elif AdhereObject.ret_val == -1:
             layout.label(getTransText("Faces Of Mesh Not Selected"), icon = 'ERROR')
+        elif AdhereObject.ret_val == -3:
+            layout.label(getTransText("No Face Material Matches A Source"), icon = 'ERROR')
         else:
             pass
 
 
+class AdhereObjectInSteps(AdhereObject):
+    bl_idname  = "object.adhere_object_in_steps"
+    bl_label = getTransText("Execute Mesh Adhesion In Steps")
+    bl_description = getTransText("Create the copies a chunk at a time, press ESC to cancel")
+    bl_options = {'REGISTER','UNDO'}
+
+    # Copies per chunk and seconds of work per timer tick
+    chunk_size = 100
+    tick_budget = 0.05
+    navigation_events = {'MIDDLEMOUSE', 'WHEELUPMOUSE', 'WHEELDOWNMOUSE',
+                         'TRACKPADPAN', 'TRACKPADZOOM', 'MOUSEMOVE',
+                         'NDOF_MOTION', 'NDOF_BUTTON_FIT'}
+
+    def invoke(self, context, event):
+        wm = context.window_manager
+        self.aobj = self.startAdhesion(context, AdhereObjectInSteps.chunk_size)
+        if(AdhereObject.ret_val != 0):
+            return wm.invoke_popup(self, width=250, height=100)
+        if self.aobj.pending is None:
+            # Nothing to create in steps, e.g. Center Of Selected Faces
+            return self.finishAdhesion(context, self.aobj)
+
+        # Multiple adhesion also solves and culls in the steps, so its total
+        # is only known as it goes and progress is shown as a fraction
+        self.progress = (0, self.aobj.copy_total)
+        wm.progress_begin(0.0, 1.0)
+        self.timer = wm.event_timer_add(0.01, context.window)
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        if event.type == 'ESC':
+            # Roll back every copy created so far
+            self.aobj.removeCopies()
+            self.endSteps(context)
+            return {'CANCELLED'}
+
+        if event.type != 'TIMER':
+            # Only view navigation may reach Blender while copies are pending,
+            # undo or edits would free the objects the run still holds
+            if event.type in AdhereObjectInSteps.navigation_events:
+                return {'PASS_THROUGH'}
+            return {'RUNNING_MODAL'}
+
+        time_start = time.perf_counter()
+        while time.perf_counter() - time_start < AdhereObjectInSteps.tick_budget:
+            try:
+                self.progress = next(self.aobj.pending)
+            except StopIteration:
+                self.endSteps(context)
+                return self.finishAdhesion(context, self.aobj)
+
+        context.window_manager.progress_update(self.progress[0] / max(self.progress[1], 1))
+        if context.area is not None:
+            context.area.header_text_set("%s: %d / %d" % (getTransText("Mesh Adhesion"),
+                                                          self.progress[0], self.progress[1]))
+        return {'RUNNING_MODAL'}
+
+    def endSteps(self, context):
+        wm = context.window_manager
+        wm.event_timer_remove(self.timer)
+        wm.progress_end()
+        if context.area is not None:
+            context.area.header_text_set()
+        self.aobj.pending = None
+
+
+class ExportPlacements(AdhereObject, ExportHelper):
+    bl_idname  = "object.adhere_export_placements"
+    bl_label = getTransText("Export Placements")
+    bl_description = getTransText("Write the placements of the copies to a file without creating them")
+    bl_options = {'REGISTER'}
+
+    filename_ext = ".madp"
+    filter_glob = bpy.props.StringProperty(default="*.madp", options={'HIDDEN'})
+
+    @classmethod
+    def poll(cls, context):
+        return context.scene.adhere_option in ("MULTIPLE", "ISLAND", "SCATTER")
+
+    def invoke(self, context, event):
+        # The file browser shows draw, so clear errors of earlier runs
+        AdhereObject.ret_val = 0
+        return ExportHelper.invoke(self, context, event)
+
+    def execute(self, context):
+        wm = context.window_manager
+        aobj = self.startAdhesion(context, None, "NONE")
+        if(AdhereObject.ret_val != 0):
+            return wm.invoke_popup(self, width=250, height=100)
+
+        placement_io.writePlacements(self.filepath, aobj.placement_log)
+        self.report({'INFO'}, "%s: %d" % (getTransText("Placements Exported"),
+                                          sum(placements.count() for name, placements
+                                              in aobj.placement_log)))
+        return {'FINISHED'}
+
+
+class ImportPlacements(bpy.types.Operator, ImportHelper):
+    bl_idname  = "object.adhere_import_placements"
+    bl_label = getTransText("Import Placements")
+    bl_description = getTransText("Create copies of the source meshes from a placement file")
+    bl_options = {'REGISTER','UNDO'}
+
+    filename_ext = ".madp"
+    filter_glob = bpy.props.StringProperty(default="*.madp", options={'HIDDEN'})
+
+    def execute(self, context):
+        scene = context.scene
+        try:
+            placement_file = placement_io.readPlacements(self.filepath)
+        except (IOError, ValueError) as err:
+            self.report({'ERROR'}, str(err))
+            return {'CANCELLED'}
+
+        # Sources missing from this file fall back to the selected mesh
+        sel_obj = bpy.data.objects.get(context.window_manager.mesh_collection.sel_mesh)
+        aobj = adhere_object.AdhereProc()
+        for source_id, name in enumerate(placement_file.source_names):
+            adh_obj = bpy.data.objects.get(name, sel_obj)
+            if adh_obj is None:
+                self.report({'WARNING'}, "%s: %s" % (getTransText("Source Mesh Not Found"),
+                                                     name))
+                continue
+            placements = placement_file.placements(source_id)
+            if placements.count() > 0:
+                aobj.createCopies(adh_obj, placements, scene.objcopy_option)
+
+        return {'FINISHED'}
+
+
 class SelectObject(bpy.types.Operator):
     bl_idname  = "object.select_object"
     bl_label = getTransText("Mesh Select")
@@ -211,16 +652,9 @@ class SelectObject(bpy.types.Operator):
         elif event.type == 'LEFTMOUSE':
             if event.value == 'RELEASE':
 
-                # Select object
-                loc = event.mouse_region_x, event.mouse_region_y
-                ret = bpy.ops.view3d.select(object=True,location=loc)
-                if ret == {'PASS_THROUGH'}:
-                    cursor_set.cursor_modal_restore()
-                    scene.running = False
-                    return {'CANCELLED'}
-                
-                new_selected_obj = bpy.context.selected_objects[0]
-                if new_selected_obj.type != 'MESH':
+                # Pick object by ray without changing the selection
+                new_selected_obj = self.pickObject(context, event)
+                if new_selected_obj is None:
                     cursor_set.cursor_modal_restore()
                     scene.running = False
                     return {'CANCELLED'}
@@ -239,6 +673,24 @@ class SelectObject(bpy.types.Operator):
 
         return {'RUNNING_MODAL'}
 
+    def pickObject(self, context, event):
+        # 3D view region under the mouse
+        for area in context.window.screen.areas:
+            if area.type != 'VIEW_3D':
+                continue
+            for region in area.regions:
+                if region.type != 'WINDOW':
+                    continue
+                if region.x <= event.mouse_x < region.x + region.width and \
+                   region.y <= event.mouse_y < region.y + region.height:
+                    rv3d = area.spaces.active.region_3d
+                    coord = (event.mouse_x - region.x, event.mouse_y - region.y)
+                    origin = view3d_utils.region_2d_to_origin_3d(region, rv3d, coord)
+                    direction = view3d_utils.region_2d_to_vector_3d(region, rv3d, coord)
+                    return caches.scene_ray_index.pick(context.scene, origin, direction)
+
+        return None
+
 
 class VIEW3D_DisplayMenu(bpy.types.Panel):
     bl_label = getTransText("Mesh Adhesion")
@@ -282,20 +734,64 @@ class VIEW3D_DisplayMenu(bpy.types.Panel):
         col.label(text=getTransText("Adhesion Option:"))
         col.prop(scene, 'adhere_option', text="", expand=False)
 
-        if(scene.adhere_option == "MULTIPLE"):
+        if(scene.adhere_option == "SCATTER"):
+            col = layout.column(align=True)
+            col.prop(scene, "scatter_count")
+            col.prop(scene, "scatter_seed")
+
+        if(scene.adhere_option in ("MULTIPLE", "ISLAND", "SCATTER")):
             col = layout.column(align=True)
             col.label(text=getTransText("Type Of Mesh Duplication:"))
             row = col.row(align=True)
             row.prop(scene, 'objcopy_option', expand=True)
 
+            if scene.adhere_option == "MULTIPLE" and scene.objcopy_option in ("COPY", "REFERENCE") \
+               and scene.orient_option == "NORMAL":
+                col.prop(scene, "live_adhesion")
+
+            col = layout.column(align=True)
+            col.prop(scene, "cull_overlap")
+            sub = col.column(align=True)
+            sub.active = scene.cull_overlap
+            sub.prop(scene, "cull_spacing")
+
+        if(scene.adhere_option == "MULTIPLE"):
+            col = layout.column(align=True)
+            col.label(text=getTransText("Orientation:"))
+            col.prop(scene, "orient_option", text="")
+
+            col = layout.column(align=True)
+            col.prop(scene, "multi_target")
+            col.prop_search(scene, "source_group", bpy.data, "groups", text="")
+            if scene.source_group != "":
+                col.prop(scene, "source_assign", text="")
+                if scene.source_assign == "RANDOM":
+                    col.prop(scene, "scatter_seed")
+
         col = layout.column(align=True)
         col.label(text=getTransText("Offset Position:"))
         col.prop(scene, "offset_x")
         col.prop(scene, "offset_y")
         col.prop(scene, "offset_z")
 
+        col = layout.column(align=True)
+        col.prop(scene, "profile_phases")
+        sub = col.column(align=True)
+        sub.active = scene.profile_phases
+        sub.prop(scene, "profile_log", text="")
+
         layout.separator()
-        layout.operator(AdhereObject.bl_idname,text=getTransText("Execute"))
+        if scene.adhere_option in ("MULTIPLE", "ISLAND", "SCATTER") and \
+           scene.objcopy_option in ("COPY", "REFERENCE"):
+            row = layout.row(align=True)
+            row.operator(AdhereObject.bl_idname,text=getTransText("Execute"))
+            row.operator(AdhereObjectInSteps.bl_idname, text="", icon='TIME')
+        else:
+            layout.operator(AdhereObject.bl_idname,text=getTransText("Execute"))
+
+        row = layout.row(align=True)
+        row.operator(ExportPlacements.bl_idname, text=getTransText("Export"), icon='EXPORT')
+        row.operator(ImportPlacements.bl_idname, text=getTransText("Import"), icon='IMPORT')
 
 
 def init_props():
@@ -308,8 +804,69 @@ def init_props():
     scene.offset_y = bpy.props.FloatProperty(name="Y")
     scene.offset_z = bpy.props.FloatProperty(name="Z")
 
+    scene.scatter_count = bpy.props.IntProperty(name=getTransText("Count"),
+                                                default=100, min=1)
+    scene.scatter_seed = bpy.props.IntProperty(name=getTransText("Seed"),
+                                               default=0, min=0)
+
+    scene.cull_overlap = bpy.props.BoolProperty(name=getTransText("Cull Overlapping Copies"),
+                                                default=False)
+    scene.cull_spacing = bpy.props.FloatProperty(
+            name = getTransText("Minimum Spacing"),
+            description = getTransText("Spacing between copies, 0 uses the bounding radius of the mesh"),
+            default = 0.0, min = 0.0, subtype = 'DISTANCE'
+    )
+
+    orient_option_tuple = (("NORMAL", getTransText("Normal Only"), ""),
+                           ("LONGEST_EDGE", getTransText("Longest Edge"), ""),
+                           ("FIRST_EDGE", getTransText("First Edge"), ""),
+                           ("WORLD_X", getTransText("World X Axis"), ""),
+                           ("WORLD_Y", getTransText("World Y Axis"), ""),
+                           ("WORLD_Z", getTransText("World Z Axis"), ""))
+    scene.orient_option = bpy.props.EnumProperty(
+            name = getTransText("Orientation:"),
+            description = getTransText("Direction the X axis of the adhered mesh follows on each face"),
+            items = orient_option_tuple
+    )
+
+    scene.multi_target = bpy.props.BoolProperty(
+            name = getTransText("All Selected Objects"),
+            description = getTransText("Adhere to the selected faces of every selected mesh object"),
+            default = False
+    )
+    scene.source_group = bpy.props.StringProperty(
+            name = getTransText("Source Group"),
+            description = getTransText("Adhere the meshes of this group instead of the selected mesh"),
+            default = ""
+    )
+    source_assign_tuple = (("ROUND_ROBIN", getTransText("Round Robin"), ""),
+                           ("RANDOM", getTransText("Random"), ""),
+                           ("MATERIAL", getTransText("By Material"), ""))
+    scene.source_assign = bpy.props.EnumProperty(
+            name = getTransText("Source Assignment"),
+            description = getTransText("How each face chooses a mesh of the source group"),
+            items = source_assign_tuple
+    )
+
+    scene.live_adhesion = bpy.props.BoolProperty(
+            name = getTransText("Follow Target Edits"),
+            description = getTransText("Keep the copies on their faces while the target mesh is edited"),
+            default = False
+    )
+
+    scene.profile_phases = bpy.props.BoolProperty(name=getTransText("Report Phase Timings"),
+                                                  default=False)
+    scene.profile_log = bpy.props.StringProperty(
+            name = getTransText("Timing Log"),
+            description = getTransText("Append the timings of each run to this JSON lines file"),
+            default = "", subtype = 'FILE_PATH'
+    )
+
     adhere_option_tuple = (("SINGLE", getTransText("Center Of Selected Faces"), ""),
-                           ("MULTIPLE", getTransText("Every Selected Faces"), ""))
+                           ("MULTIPLE", getTransText("Every Selected Faces"), ""),
+                           ("ISLAND", getTransText("Per Island"), ""),
+                           ("PROJECT", getTransText("Project Onto Surface"), ""),
+                           ("SCATTER", getTransText("Scatter Over Selected Faces"), ""))
     scene.adhere_option = bpy.props.EnumProperty(
             name = getTransText("Adhesion Option:"),
             description = getTransText("Select To Type Of Adhesion"),
@@ -317,7 +874,9 @@ def init_props():
     )
 
     obj_copy_option_tuple = (("COPY", getTransText("Copy"), ""),
-                             ("REFERENCE", getTransText("Linked"), ""))
+                             ("REFERENCE", getTransText("Linked"), ""),
+                             ("INSTANCE", getTransText("Instanced"), ""),
+                             ("MERGE", getTransText("Merged"), ""))
     scene.objcopy_option = bpy.props.EnumProperty(
             name = getTransText("Type Of Mesh Duplication:"),
             description = getTransText("Select To Type Of Adhesion"),
@@ -334,6 +893,17 @@ def clear_props():
     del scene.offset_x
     del scene.offset_y
     del scene.offset_z
+    del scene.scatter_count
+    del scene.scatter_seed
+    del scene.cull_overlap
+    del scene.cull_spacing
+    del scene.orient_option
+    del scene.multi_target
+    del scene.source_group
+    del scene.source_assign
+    del scene.live_adhesion
+    del scene.profile_phases
+    del scene.profile_log
     del scene.adhere_option
     del scene.objcopy_option
 
@@ -341,8 +911,17 @@ def register():
     bpy.app.translations.register(__name__, translation_dict)
     bpy.utils.register_module(__name__)
     init_props()
+    bpy.app.handlers.scene_update_post.append(scene_update_post)
+    bpy.app.handlers.load_pre.append(load_file)
+    bpy.app.handlers.load_post.append(load_file)
 
 def unregister():
+    bpy.app.handlers.scene_update_post.remove(scene_update_post)
+    bpy.app.handlers.load_pre.remove(load_file)
+    bpy.app.handlers.load_post.remove(load_file)
+    caches.bvh_cache.clear()
+    caches.source_cache.clear()
+    live_adhesion.clear()
     bpy.utils.unregister_module(__name__)
     bpy.app.translations.unregister(__name__)
     clear_props()
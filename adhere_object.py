@@ -26,103 +26,738 @@
 
 import bpy
 import bmesh
-import mathutils
-from mathutils import Vector, Euler
-import math
+from mathutils import Vector
+import functools
+import itertools
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from . import adhesion_core
+from . import caches
+from . import profiling
+
+
+class SelectionSnapshot(adhesion_core.FaceData):
+    def __init__(self, mesh, synced=False):
+        # Polygons of a mesh in edit mode aren't synced with its BMesh
+        # unless the object was just updated from edit mode
+        self.from_bmesh = mesh.is_editmode and not synced
+        if self.from_bmesh:
+            self.fromBMesh(mesh)
+        else:
+            self.fromPolygons(mesh)
+
+        self.average_normal = None
+        self.center_point = None
+
+    def averageNormal(self):
+        if self.average_normal is None:
+            self.average_normal = adhesion_core.FaceData.averageNormal(self)
+        return self.average_normal
+
+    def centerPoint(self):
+        if self.center_point is None:
+            self.center_point = adhesion_core.FaceData.centerPoint(self)
+        return self.center_point
+
+    def fromPolygons(self, mesh):
+        face_num = len(mesh.polygons)
+        select = np.zeros(face_num, dtype=bool)
+        normals = np.empty(face_num * 3, dtype=np.float32)
+        areas = np.empty(face_num, dtype=np.float32)
+        centers = np.empty(face_num * 3, dtype=np.float32)
+
+        mesh.polygons.foreach_get("select", select)
+        mesh.polygons.foreach_get("normal", normals)
+        mesh.polygons.foreach_get("area", areas)
+        mesh.polygons.foreach_get("center", centers)
+
+        indices = np.flatnonzero(select)
+        adhesion_core.FaceData.__init__(self, indices,
+                                        normals.reshape(-1, 3)[indices],
+                                        areas[indices],
+                                        centers.reshape(-1, 3)[indices])
+
+    def fromBMesh(self, mesh):
+        bm = AdhereProc.getBMesh(mesh)
+        # Indices of an edit BMesh are stale after topology edits, and the
+        # recorded indices are later looked up by table position
+        bm.faces.index_update()
+        select_face = [face for face in bm.faces if face.select == True]
+
+        adhesion_core.FaceData.__init__(self,
+                                        [face.index for face in select_face],
+                                        [face.normal for face in select_face],
+                                        [face.calc_area() for face in select_face],
+                                        [face.calc_center_median() for face in select_face])
+
+
+def getMeshArrays(mesh, loop_layers=False):
+    vert_num = len(mesh.vertices)
+    loop_num = len(mesh.loops)
+    face_num = len(mesh.polygons)
+    verts = np.empty(vert_num * 3, dtype=np.float32)
+    loop_verts = np.empty(loop_num, dtype=np.int32)
+    loop_start = np.empty(face_num, dtype=np.int32)
+    loop_total = np.empty(face_num, dtype=np.int32)
+    mat_index = np.empty(face_num, dtype=np.int32)
+    smooth = np.zeros(face_num, dtype=bool)
+    mesh.vertices.foreach_get("co", verts)
+    mesh.loops.foreach_get("vertex_index", loop_verts)
+    mesh.polygons.foreach_get("loop_start", loop_start)
+    mesh.polygons.foreach_get("loop_total", loop_total)
+    mesh.polygons.foreach_get("material_index", mat_index)
+    mesh.polygons.foreach_get("use_smooth", smooth)
+
+    mesh_arrays = adhesion_core.MeshArrays(verts, loop_verts, loop_start, loop_total,
+                                           mat_index, smooth)
+    if loop_layers:
+        readLoopLayers(mesh, mesh_arrays)
+    return mesh_arrays
+
+
+def readLoopLayers(mesh, mesh_arrays):
+    # UV maps, vertex colors and custom split normals, which the merged
+    # mesh keeps like the join operator does
+    loop_num = len(mesh.loops)
+    for uv_layer in mesh.uv_layers:
+        uvs = np.empty(loop_num * 2, dtype=np.float32)
+        uv_layer.data.foreach_get("uv", uvs)
+        mesh_arrays.uv_layers.append((uv_layer.name, uvs.reshape(-1, 2)))
+
+    for color_layer in mesh.vertex_colors:
+        # RGB before Blender 2.80, RGBA after
+        size = len(color_layer.data[0].color) if loop_num > 0 else 3
+        colors = np.empty(loop_num * size, dtype=np.float32)
+        color_layer.data.foreach_get("color", colors)
+        mesh_arrays.color_layers.append((color_layer.name, colors.reshape(-1, size)))
+
+    if mesh.has_custom_normals:
+        mesh.calc_normals_split()
+        normals = np.empty(loop_num * 3, dtype=np.float32)
+        mesh.loops.foreach_get("normal", normals)
+        mesh_arrays.loop_normals = normals.reshape(-1, 3)
+
+
+def getSelectedMeshArrays(obj, snapshot, indices=None):
+    # Selected faces with vertex normals and smooth flags, or only the
+    # given ones of them
+    if indices is None:
+        indices = snapshot.indices
+    mesh = obj.data
+    if not snapshot.from_bmesh:
+        mesh_arrays = getMeshArrays(mesh)
+        vert_normals = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+        mesh.vertices.foreach_get("normal", vert_normals)
+        mesh_arrays.vert_normals = vert_normals
+        return mesh_arrays.subset(indices)
+
+    bm = AdhereProc.getBMesh(mesh)
+    bm.verts.index_update()
+    bm.faces.ensure_lookup_table()
+    select_face = [bm.faces[index] for index in indices]
+    loop_total = np.array([len(face.verts) for face in select_face], dtype=np.int64)
+    loop_start = np.zeros(len(loop_total), dtype=np.int64)
+    np.cumsum(loop_total[:-1], out=loop_start[1:])
+
+    return adhesion_core.MeshArrays([vert.co for vert in bm.verts],
+                                    [vert.index for face in select_face for vert in face.verts],
+                                    loop_start, loop_total,
+                                    smooth=np.array([face.smooth for face in select_face]),
+                                    vert_normals=np.array([vert.normal for vert in bm.verts]))
+
+
+def getFaceMaterials(obj, snapshot):
+    # Material names of the object's slots and slot index of selected faces
+    slot_names = [slot.material.name if slot.material is not None else None
+                  for slot in obj.material_slots]
+    mesh = obj.data
+    if snapshot.from_bmesh:
+        bm = AdhereProc.getBMesh(mesh)
+        bm.faces.ensure_lookup_table()
+        mat_index = [bm.faces[index].material_index for index in snapshot.indices]
+        return slot_names, np.array(mat_index, dtype=np.int64)
+
+    mat_index = np.empty(len(mesh.polygons), dtype=np.int32)
+    mesh.polygons.foreach_get("material_index", mat_index)
+    return slot_names, mat_index[snapshot.indices]
+
+
+WORLD_AXES = {"WORLD_X": (1.0, 0.0, 0.0),
+              "WORLD_Y": (0.0, 1.0, 0.0),
+              "WORLD_Z": (0.0, 0.0, 1.0)}
+
+
+def getTransform(obj):
+    return adhesion_core.Transform(np.array(obj.matrix_world))
+
+
+class SourceDescriptor():
+    # Selection and mesh arrays of an adhered mesh, kept in
+    # caches.source_cache across executions
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.mesh_arrays = None
+
+    def meshArrays(self, mesh):
+        if self.mesh_arrays is None:
+            self.mesh_arrays = getMeshArrays(mesh, True)
+        return self.mesh_arrays
 
 
 class AdhereProc():
     def __init__(self):
-        pass
+        self.snapshots = {}
+
+        # None disables overlap culling, 0.0 uses the source bounding radius
+        self.cull_spacing = None
+        self.culled_num = 0
+
+        # Every copy of the run, and the placements of the last createCopies
+        self.copy_objs = []
+        self.placements = None
+        self.copy_done = 0
+        self.copy_total = 0
+
+        # (source name, placements) of every createCopies call when set to
+        # a list, None keeps no placements after their copies are created
+        self.placement_log = None
+
+        # Faces solved at a time by multiple adhesion, and the overlap
+        # culler of each source kept across the chunks
+        self.stream_size = 65536
+        self.cullers = {}
+
+        # Copies are created this many at a time through self.pending
+        # instead of all at once when set
+        self.chunk_size = None
+        self.pending = None
+
+        # NORMAL only turns the source normal onto the faces, every other
+        # option also fixes the spin around it with a tangent frame
+        self.orient_option = "NORMAL"
+
+        # Replace with a profiling.PhaseProfiler to time each phase
+        self.profiler = profiling.NULL_PROFILER
+
+    def beginRun(self):
+        # Drop the state of an earlier execution, so one AdhereProc can run again
+        self.snapshots = {}
+        self.cullers = {}
+        self.culled_num = 0
+        self.copy_objs = []
+        self.placements = None
+        self.copy_done = 0
+        self.copy_total = 0
+        self.pending = None
+        if self.placement_log is not None:
+            self.placement_log = []
 
     def execSingleAdhesion(self, org_obj, adh_obj, offset):
-        org_obj.data.update()
+        self.beginRun()
+        self.getSource(adh_obj)
 
         # Check each mesh if one or more face is selected
         ret = self.getSelectPolyErrCheck(org_obj, adh_obj)
         if ret != 0:
             return ret
 
-        # Get each normal vector
-        vector_nor_adh = self.averageNormal(adh_obj, False)
-        vector_nor_org = self.averageNormal(org_obj, True)
-        
-        self.applyRotation(adh_obj, vector_nor_adh, vector_nor_org)
-        self.applyLocation(adh_obj, self.getGlobalCenterPoint(org_obj))
-        self.applyOffset(adh_obj, offset)
+        with self.profiler.phase("solve", self.getSelectPolyNum(org_obj)):
+            placements = adhesion_core.singleAdhesion(self.getSnapshot(org_obj),
+                                                      getTransform(org_obj),
+                                                      self.getSnapshot(adh_obj),
+                                                      adh_obj.scale, offset)
+        with self.profiler.phase("transform", 1):
+            self.applyPlacements([adh_obj], placements)
 
         return 0
 
-    def execMultipleAdhesion(self, org_obj, adh_obj, offset, link):
-        org_obj.data.update()
-        adh_obj.select = True
+    def execProjectAdhesion(self, org_obj, adh_obj, offset):
+        self.beginRun()
+        self.getSource(adh_obj)
 
         # Check each mesh if one or more face is selected
         ret = self.getSelectPolyErrCheck(org_obj, adh_obj)
         if ret != 0:
             return ret
 
-        # Get each normal vector
-        vector_nor_adh = self.averageNormal(adh_obj, False)
-        vector_nor_org_list = self.multiAverageNormal(org_obj, True)
+        adh_snapshot = self.getSnapshot(adh_obj)
+        adh_mesh_arrays = self.getSource(adh_obj).meshArrays(adh_obj.data)
+        with self.profiler.phase("solve", self.getSelectPolyNum(org_obj)):
+            footprint = adhesion_core.footprintPoints(adh_mesh_arrays, adh_snapshot.indices)
+            placements = adhesion_core.projectedAdhesion(self.getSnapshot(org_obj),
+                                                         getTransform(org_obj),
+                                                         adh_snapshot, footprint,
+                                                         adh_obj.scale, offset,
+                                                         self.getRaycast(org_obj))
+        with self.profiler.phase("transform", 1):
+            self.applyPlacements([adh_obj], placements)
 
-        # Duplicate mesh
-        sel_polynum = self.getSelectPolyNum(org_obj.data)
-        adhobj_list = self.getDuplicateObjList(adh_obj, sel_polynum, link)
+        return 0
+
+    def getRaycast(self, obj):
+        tree = caches.bvh_cache.get(obj)
+        transform = getTransform(obj)
+        inv_matrix = transform.inverted().matrix
+
+        # Rays start beyond the bounds of the object
+        corners = transform.applyToPoints(np.array(obj.bound_box))
+        lift = np.linalg.norm(corners.max(axis=0) - corners.min(axis=0)) + 1.0
+
+        def raycast(points, direction):
+            origins = points - direction * lift
+            local_origins = origins.dot(inv_matrix[:3, :3].T) + inv_matrix[:3, 3]
+            local_direction = Vector(inv_matrix[:3, :3].dot(direction))
 
-        org_mesh_center_list = self.getMultiGlobalCenterPoint(org_obj)
-        for vector_nor_org in vector_nor_org_list:
-            # Get duplicated mesh
-            dup_obj = adhobj_list[0]
-            adhobj_list.pop(0)
+            hits = np.full((len(points), 3), np.nan)
+            hit_normals = np.full((len(points), 3), np.nan)
+            for i, origin in enumerate(local_origins):
+                location, normal, index, dist = tree.ray_cast(Vector(origin), local_direction)
+                if location is not None:
+                    hits[i] = location
+                    hit_normals[i] = normal
+            return transform.applyToPoints(hits), transform.applyToNormals(hit_normals)
+
+        return raycast
+
+    def execMultipleAdhesion(self, org_obj, adh_obj, offset, copy_option):
+        self.beginRun()
+        self.getSource(adh_obj)
+
+        # Check each mesh if one or more face is selected
+        ret = self.getSelectPolyErrCheck(org_obj, adh_obj)
+        if ret != 0:
+            return ret
 
-            # Get center position
-            org_mesh_center = org_mesh_center_list[0]
-            org_mesh_center_list.pop(0)
+        # Stream the selection through transform, solve, cull and creation
+        # in chunks, so the temporaries are bounded by stream_size faces
+        tangents = None
+        if self.orient_option != "NORMAL":
+            tangents = functools.partial(self.getFaceTangents, org_obj)
+        stages = adhesion_core.iterMultipleAdhesion(self.getSnapshot(org_obj),
+                                                    getTransform(org_obj),
+                                                    self.getSnapshot(adh_obj), adh_obj.scale,
+                                                    offset, self.stream_size, tangents,
+                                                    self.profiler)
+        steps = self.iterStages(adh_obj, stages, copy_option, self.getSelectPolyNum(org_obj))
+        if self.chunk_size is not None:
+            # The caller drives solving and culling as well as the creation
+            self.queueSteps(steps)
+            return 0
+
+        for progress in steps:
+            pass
+        return 0
 
-            self.applyRotation(dup_obj, vector_nor_adh, vector_nor_org)
-            self.applyLocation(dup_obj, org_mesh_center)
-            self.applyOffset(dup_obj, offset)
+    def iterStages(self, adh_obj, stages, copy_option, face_num):
+        # Solve, cull and create the copies of one stage after another,
+        # yielding (created, total) in between. Faces not solved yet count
+        # as copies still to come.
+        merged_chunks = []
+        merged_num = 0
+        solved_num = 0
+        for placements in stages:
+            solved_num += placements.count()
+            placements = self.cullPlacements(adh_obj, placements)
+            steps = ()
+            if copy_option in ("INSTANCE", "MERGE"):
+                # One carrier or merged mesh holds the copies of every chunk
+                merged_chunks.append(placements)
+                merged_num += placements.count()
+            else:
+                steps = self.prepareCopies(adh_obj, placements, copy_option)
+
+            remaining = merged_num + face_num - solved_num
+            yield self.copy_done, self.copy_total + remaining
+            for copy_done, copy_total in steps:
+                yield copy_done, copy_total + remaining
+
+        if len(merged_chunks) > 0:
+            for progress in self.prepareCopies(adh_obj,
+                                               adhesion_core.concatPlacements(merged_chunks),
+                                               copy_option):
+                yield progress
+
+    def getFaceTangents(self, obj, start, count):
+        # World tangents of count selected faces from start for orient_option
+        axis = WORLD_AXES.get(self.orient_option)
+        if axis is not None:
+            return np.tile(axis, (count, 1))
+
+        # Only the faces of the chunk are read, not the whole selection
+        snapshot = self.getSnapshot(obj)
+        chunk_arrays = getSelectedMeshArrays(obj, snapshot,
+                                             snapshot.indices[start:start + count])
+        tangents = chunk_arrays.edgeTangents(self.orient_option == "LONGEST_EDGE")
+        return getTransform(obj).applyToVectors(tangents)
+
+    def execMultiAdhesion(self, org_objs, adh_objs, offset, copy_option,
+                          assign_mode, seed):
+        # Every selected face of every target gets a copy of one of the sources
+        self.beginRun()
+        sources = []
+        for adh_obj in adh_objs:
+            if self.getSource(adh_obj).snapshot.count() > 0:
+                sources.append(adh_obj)
+        if len(sources) == 0:
+            return -2
+
+        with self.profiler.phase("check") as phase:
+            targets = [obj for obj in org_objs if self.getSelectPolyExist(obj)]
+            phase.face_num = sum(self.getSelectPolyNum(obj) for obj in targets)
+        if len(targets) == 0:
+            return -1
+
+        # Export everything from Blender first, the math then runs in threads
+        source_data = [(self.getSnapshot(obj), tuple(obj.scale)) for obj in sources]
+        source_materials = None
+        if assign_mode == "MATERIAL":
+            source_materials = [set(getFaceMaterials(obj, self.getSnapshot(obj))[0])
+                                for obj in sources]
+        jobs = []
+        start = 0
+        for target_index, org_obj in enumerate(targets):
+            snapshot = self.getSnapshot(org_obj)
+            tangents = None
+            if self.orient_option != "NORMAL":
+                tangents = self.getFaceTangents(org_obj, 0, snapshot.count())
+            key_sources = None
+            mat_index = None
+            if assign_mode == "MATERIAL":
+                slot_names, mat_index = getFaceMaterials(org_obj, snapshot)
+                key_sources = [next((i for i, names in enumerate(source_materials)
+                                     if name is not None and name in names), -1)
+                               for name in slot_names]
+            jobs.append((snapshot, getTransform(org_obj), tangents, start,
+                         seed + target_index, mat_index, key_sources))
+            start += snapshot.count()
+
+        def solveTarget(job):
+            snapshot, transform, tangents, start, target_seed, mat_index, key_sources = job
+            assign = adhesion_core.assignSources(snapshot.count(), len(sources), assign_mode,
+                                                 target_seed, start, mat_index, key_sources)
+            return adhesion_core.multiSourceAdhesion(snapshot, transform, source_data,
+                                                     assign, offset, tangents)
+
+        with self.profiler.phase("solve", start):
+            with ThreadPoolExecutor(max_workers=min(len(jobs), os.cpu_count() or 1)) as executor:
+                results = list(executor.map(solveTarget, jobs))
+
+        # Only MATERIAL leaves faces without a source
+        if all(placements.count() == 0 for placements_list in results
+               for placements in placements_list):
+            return -3
+
+        # Create the copies of each source for all targets in one batch
+        for source_index, adh_obj in enumerate(sources):
+            placements = adhesion_core.concatPlacements(
+                [placements_list[source_index] for placements_list in results])
+            if placements.count() > 0:
+                self.createCopies(adh_obj, placements, copy_option)
 
         return 0
 
-    def getSelectPolyErrCheck(self, org_obj, adh_obj):
-        ret = 0
-        if self.getSelectPolyExist(adh_obj.data) == False:
-            ret = -2
+    def execIslandAdhesion(self, org_obj, adh_obj, offset, copy_option):
+        self.beginRun()
+        self.getSource(adh_obj)
+
+        # Check each mesh if one or more face is selected
+        ret = self.getSelectPolyErrCheck(org_obj, adh_obj)
+        if ret != 0:
             return ret
 
-        if self.getSelectPolyExist(org_obj.data) == False:
-            ret = -1
+        org_snapshot = self.getSnapshot(org_obj)
+        with self.profiler.phase("solve", org_snapshot.count()):
+            org_mesh_arrays = getSelectedMeshArrays(org_obj, org_snapshot)
+            placements = adhesion_core.islandAdhesion(org_mesh_arrays, org_snapshot,
+                                                      getTransform(org_obj),
+                                                      self.getSnapshot(adh_obj),
+                                                      adh_obj.scale, offset)
+        self.createCopies(adh_obj, placements, copy_option)
+
+        return 0
+
+    def execScatterAdhesion(self, org_obj, adh_obj, offset, copy_option, count, seed):
+        self.beginRun()
+        self.getSource(adh_obj)
+
+        # Check each mesh if one or more face is selected
+        ret = self.getSelectPolyErrCheck(org_obj, adh_obj)
+        if ret != 0:
             return ret
 
+        with self.profiler.phase("solve", self.getSelectPolyNum(org_obj)):
+            org_mesh_arrays = getSelectedMeshArrays(org_obj, self.getSnapshot(org_obj))
+            placements = adhesion_core.scatterAdhesion(org_mesh_arrays, getTransform(org_obj),
+                                                       self.getSnapshot(adh_obj),
+                                                       adh_obj.scale, offset, count, seed)
+        self.createCopies(adh_obj, placements, copy_option)
+
+        return 0
+
+    def createCopies(self, adh_obj, placements, copy_option):
+        # Copies of repeated calls within one run add up in self.copy_objs
+        copy_start = len(self.copy_objs)
+        steps = self.prepareCopies(adh_obj, self.cullPlacements(adh_obj, placements),
+                                   copy_option)
+        if copy_option == "NONE":
+            # Solve only, e.g. to export the placements
+            return []
+        if self.chunk_size is not None:
+            # The caller drives the creation chunk by chunk
+            self.queueSteps(steps)
+            return []
+
+        for progress in steps:
+            pass
+        return self.copy_objs[copy_start:]
+
+    def prepareCopies(self, adh_obj, placements, copy_option):
+        # Log the placements and return the steps creating their copies
+        self.placements = placements
+        if self.placement_log is not None:
+            self.placement_log.append((adh_obj.name, placements))
+        if copy_option == "NONE":
+            return ()
+        self.copy_total += placements.count()
+        return self.iterCopies(adh_obj, placements, copy_option)
+
+    def queueSteps(self, steps):
+        if self.pending is None:
+            self.pending = steps
+        else:
+            self.pending = itertools.chain(self.pending, steps)
+
+    def iterCopies(self, adh_obj, placements, copy_option):
+        # Create the copies, yielding (created, total) after every chunk
+        place_num = placements.count()
+
+        if copy_option == "INSTANCE":
+            with self.profiler.phase("duplication", place_num):
+                self.copy_objs.append(self.createInstanceCarrier(adh_obj, placements))
+            self.copy_done += place_num
+            yield self.copy_done, self.copy_total
+            return
+        elif copy_option == "MERGE":
+            with self.profiler.phase("duplication", place_num):
+                self.copy_objs.append(self.createMergedObject(adh_obj, placements))
+            self.copy_done += place_num
+            yield self.copy_done, self.copy_total
+            return
+
+        # Duplicate mesh
+        link = False
+        if copy_option == "REFERENCE":
+            link = True
+        chunk_size = self.chunk_size or max(place_num, 1)
+        for chunk_start in range(0, place_num, chunk_size):
+            chunk = placements.subset(slice(chunk_start, chunk_start + chunk_size))
+            with self.profiler.phase("duplication", chunk.count()):
+                adhobj_list = self.getDuplicateObjList(adh_obj, chunk.count(), link)
+            with self.profiler.phase("transform", chunk.count()):
+                self.applyPlacements(adhobj_list, chunk)
+            self.copy_objs.extend(adhobj_list)
+            self.copy_done += chunk.count()
+            yield self.copy_done, self.copy_total
+
+    def removeCopies(self):
+        # Undo the copies created so far, with the meshes only they used
+        # Copies already removed by the user are skipped
+        scene = bpy.context.scene
+        for obj in self.copy_objs:
+            try:
+                children = list(obj.children)
+                mesh = obj.data
+            except ReferenceError:
+                continue
+            for child in children:
+                bpy.data.objects.remove(child, do_unlink=True)
+            bpy.data.objects.remove(obj, do_unlink=True)
+            if mesh.users == 0:
+                bpy.data.meshes.remove(mesh)
+        self.copy_objs = []
+        scene.update()
+
+    def cullPlacements(self, adh_obj, placements):
+        # Placements kept after overlap culling, all of them when it's off
+        if self.cull_spacing is None:
+            return placements
+
+        with self.profiler.phase("cull", placements.count()):
+            adh_center = self.getSnapshot(adh_obj).centerPoint()
+            culler = self.cullers.get(adh_obj.name)
+            if culler is None:
+                spacing = self.cull_spacing
+                if spacing <= 0.0:
+                    adh_mesh_arrays = self.getSource(adh_obj).meshArrays(adh_obj.data)
+                    spacing = adhesion_core.boundingRadius(adh_mesh_arrays.verts, adh_center,
+                                                           adh_obj.scale)
+                culler = adhesion_core.OverlapCuller(spacing)
+                self.cullers[adh_obj.name] = culler
+
+            placements, culled_num = adhesion_core.cullPlacements(placements, adh_center,
+                                                                  adh_obj.scale, culler)
+        self.culled_num += culled_num
+        return placements
+
+    def applyPlacements(self, objs, placements):
+        # Copies of a parented object share the space of its parent
+        if len(objs) > 0 and objs[0].parent is not None:
+            parent_matrix = np.array(objs[0].parent.matrix_world).dot(
+                np.array(objs[0].matrix_parent_inverse))
+            placements = placements.toParentSpace(parent_matrix)
+
+        # Tangent frames are written as quaternions, skipping the Euler
+        # conversion and its gimbal flips
+        if self.orient_option == "NORMAL":
+            rotation_attr = "rotation_euler"
+            rotations = placements.eulers().tolist()
+        else:
+            rotation_attr = "rotation_quaternion"
+            rotations = placements.quats.tolist()
+            for obj in objs:
+                obj.rotation_mode = 'QUATERNION'
+
+        locations = placements.locations.tolist()
+        if placements.offsets is None:
+            for obj, rotation, location in zip(objs, rotations, locations):
+                setattr(obj, rotation_attr, rotation)
+                obj.location = location
+        else:
+            offsets = placements.offsets.tolist()
+            for obj, rotation, location, offset in zip(objs, rotations, locations, offsets):
+                setattr(obj, rotation_attr, rotation)
+                obj.location = location
+                obj.delta_location = offset
+
+    def createInstanceCarrier(self, adh_obj, placements):
+        scene = bpy.context.scene
+        place_num = placements.count()
+
+        # Face duplication puts the instance at the center of each triangle
+        tri_size = max(max(adh_obj.dimensions), 1.0e-3)
+        tri_verts = adhesion_core.instanceTriangles(placements, tri_size)
+        mesh = self.buildMesh(adh_obj.name + "_instances",
+                              adhesion_core.MeshArrays(tri_verts,
+                                                       np.arange(place_num * 3),
+                                                       np.arange(0, place_num * 3, 3),
+                                                       np.full(place_num, 3)))
+        mesh.update(calc_edges=True)
+
+        carrier = bpy.data.objects.new(mesh.name, mesh)
+        carrier.dupli_type = 'FACES'
+        carrier.draw_type = 'WIRE'
+
+        # The instanced object shares the adhered mesh and is only scaled
+        inst_obj = adh_obj.copy()
+        inst_obj.parent = carrier
+        inst_obj.matrix_parent_inverse.identity()
+        inst_obj.location = (0.0, 0.0, 0.0)
+        inst_obj.rotation_mode = 'XYZ'
+        inst_obj.rotation_euler = (0.0, 0.0, 0.0)
+        inst_obj.delta_location = (0.0, 0.0, 0.0)
+        inst_obj.delta_rotation_euler = (0.0, 0.0, 0.0)
+
+        scene.objects.link(carrier)
+        scene.objects.link(inst_obj)
+        carrier.select = False
+        inst_obj.select = False
+        scene.update()
+
+        return carrier
+
+    def createMergedObject(self, adh_obj, placements):
+        scene = bpy.context.scene
+        adh_mesh = adh_obj.data
+
+        tile_arrays = adhesion_core.tileMesh(self.getSource(adh_obj).meshArrays(adh_mesh),
+                                             placements, adh_obj.scale)
+        mesh = self.buildMesh(adh_obj.name + "_merged", tile_arrays)
+        for material in adh_mesh.materials:
+            mesh.materials.append(material)
+        mesh.update(calc_edges=True)
+        if tile_arrays.loop_normals is not None:
+            # Custom normals are only used with auto smooth
+            mesh.use_auto_smooth = True
+            mesh.auto_smooth_angle = adh_mesh.auto_smooth_angle
+            mesh.normals_split_custom_set(tile_arrays.loop_normals)
+
+        merged_obj = bpy.data.objects.new(mesh.name, mesh)
+        scene.objects.link(merged_obj)
+        merged_obj.select = False
+        scene.update()
+
+        return merged_obj
+
+    def buildMesh(self, name, mesh_arrays):
+        mesh = bpy.data.meshes.new(name)
+        mesh.vertices.add(len(mesh_arrays.verts))
+        mesh.loops.add(len(mesh_arrays.loop_verts))
+        mesh.polygons.add(mesh_arrays.faceCount())
+        mesh.vertices.foreach_set("co", mesh_arrays.verts.astype(np.float32).ravel())
+        mesh.loops.foreach_set("vertex_index", mesh_arrays.loop_verts.astype(np.int32))
+        mesh.polygons.foreach_set("loop_start", mesh_arrays.loop_start.astype(np.int32))
+        mesh.polygons.foreach_set("loop_total", mesh_arrays.loop_total.astype(np.int32))
+        if mesh_arrays.mat_index is not None:
+            mesh.polygons.foreach_set("material_index", mesh_arrays.mat_index.astype(np.int32))
+        if mesh_arrays.smooth is not None:
+            mesh.polygons.foreach_set("use_smooth", mesh_arrays.smooth.astype(bool))
+
+        for name, uvs in mesh_arrays.uv_layers:
+            # UV maps are added through their texture slots before 2.80
+            if hasattr(mesh, "uv_textures"):
+                uv_layer = mesh.uv_layers[mesh.uv_textures.new(name).name]
+            else:
+                uv_layer = mesh.uv_layers.new(name=name)
+            uv_layer.data.foreach_set("uv", uvs.astype(np.float32).ravel())
+        for name, colors in mesh_arrays.color_layers:
+            color_layer = mesh.vertex_colors.new(name)
+            color_layer.data.foreach_set("color", colors.astype(np.float32).ravel())
+
+        return mesh
+
+    def getSnapshot(self, obj):
+        # Build the selection snapshot only once per object and execution
+        snapshot = self.snapshots.get(obj.name)
+        if snapshot is None:
+            snapshot = SelectionSnapshot(obj.data, self.syncEditMesh(obj))
+            self.snapshots[obj.name] = snapshot
+        return snapshot
+
+    def getSource(self, obj):
+        # The adhered mesh is read once per distinct state, not per execution
+        source = caches.source_cache.get(obj, self.buildSource)
+        self.snapshots[obj.name] = source.snapshot
+        return source
+
+    def buildSource(self, obj):
+        return SourceDescriptor(self.getSnapshot(obj))
+
+    def syncEditMesh(self, obj):
+        # Write the edit mesh into the mesh once, staying in edit mode, so
+        # the polygons can be read in bulk instead of face by face
+        if not obj.data.is_editmode or not hasattr(obj, "update_from_editmode"):
+            return False
+        return obj.update_from_editmode()
+
+    def getSelectPolyErrCheck(self, org_obj, adh_obj):
+        # Reading both selection snapshots is the bulk of this phase
+        with self.profiler.phase("check") as phase:
+            ret = 0
+            if self.getSelectPolyExist(adh_obj) == False:
+                ret = -2
+                return ret
+
+            if self.getSelectPolyExist(org_obj) == False:
+                ret = -1
+                return ret
+
+            phase.face_num = self.getSelectPolyNum(org_obj)
+
         return ret
 
-    def applyRotation(self, adh_obj, vector_nor_adh, vector_nor_org):
-        vector_inv_adh = vector_nor_adh * -1.0
-        quat_rot = vector_inv_adh.rotation_difference(vector_nor_org)
-        eul_rot = quat_rot.to_euler()
-        adh_obj.rotation_euler = eul_rot
-
-    def applyLocation(self, adh_obj, org_mesh_center):
-        adh_mesh_center = self.getGlobalCenterPoint(adh_obj)
-        adh_obj_center = adh_obj.location
-        move_vector = (adh_obj_center[0] - adh_mesh_center[0],
-                       adh_obj_center[1] - adh_mesh_center[1],
-                       adh_obj_center[2] - adh_mesh_center[2])
-
-        adh_obj.location = (org_mesh_center[0] + move_vector[0],
-                            org_mesh_center[1] + move_vector[1],
-                            org_mesh_center[2] + move_vector[2])
-
-    def applyOffset(self, obj, offset):
-        if offset[0] != 0.0 or offset[1] != 0.0 or offset[2] != 0.0:
-            eul_rot = obj.rotation_euler
-            offset_vect = Vector(offset)
-            offset_vect.rotate(eul_rot)
-            obj.delta_location = (offset_vect.x, offset_vect.y, offset_vect.z)
-
-    def getBMesh(self, mesh):
+    @staticmethod
+    def getBMesh(mesh):
         if mesh.is_editmode:
             bm = bmesh.from_edit_mesh(mesh)
         else:
@@ -131,153 +766,27 @@ class AdhereProc():
 
         return bm
 
-    def getSelectPolyNum(self, mesh):
-        num = 0
-        bm = self.getBMesh(mesh)
-        for face in bm.faces:
-            if face.select == True:
-                num += 1
-        return num
-
-    def getSelectPolyExist(self, mesh):
-        select_obj_exist = False
-
-        bm = self.getBMesh(mesh)
-        for face in bm.faces:
-            if face.select == True:
-                select_obj_exist = True
-                break
-        
-        return select_obj_exist
+    def getSelectPolyNum(self, obj):
+        return self.getSnapshot(obj).count()
+
+    def getSelectPolyExist(self, obj):
+        return self.getSnapshot(obj).count() > 0
 
     def getDuplicateObjList(self, dup_obj, dup_num, link):
         dup_objlist = []
-        active_obj = bpy.context.active_object
-        select_obj = bpy.context.selected_objects
-
-        # Argument mesh is only selected
-        bpy.ops.object.mode_set(mode='OBJECT')
-        for obj in select_obj:
-            if obj != dup_obj:
-                obj.select = False
+        scene = bpy.context.scene
 
-        # duplicate
+        # Create datablocks directly instead of running the duplicate operator
         for i in range(0, dup_num):
-            bpy.ops.object.duplicate(linked=link)
-            new_obj = bpy.context.selected_objects[0]
+            new_obj = dup_obj.copy()
+            if link == False:
+                new_obj.data = dup_obj.data.copy()
             dup_objlist.append(new_obj)
 
-        # Restore mesh selection
-        dup_objlist[-1].select = False
-        for obj in select_obj:
-            obj.select = True
-        active_obj.select = True
-        bpy.context.scene.objects.active = active_obj          
-        bpy.ops.object.mode_set(mode='EDIT')
+        # Link every duplicate to the scene and update only once
+        for new_obj in dup_objlist:
+            scene.objects.link(new_obj)
+            new_obj.select = False
+        scene.update()
 
         return dup_objlist
-
-    def getSelectedFaces(self, bm):
-        select_face = []
-        for face in bm.faces:
-            if face.select == True:
-                select_face.append(face)
-
-        return select_face
-
-    def averageNormal(self, obj, is_global):
-        weight_norx = 0.
-        weight_nory = 0.
-        weight_norz = 0.
-        aver_normal = None
-        bm = self.getBMesh(obj.data)
-        select_face = self.getSelectedFaces(bm)
-
-        for face in select_face:
-            weight_norx += face.normal.x * face.calc_area()
-            weight_nory += face.normal.y * face.calc_area()
-            weight_norz += face.normal.z * face.calc_area()
-
-        aver_normal = Vector((weight_norx, weight_nory, weight_norz))
-        aver_normal.normalize()
-
-        if is_global == True:
-            eul_obj_rot = obj.rotation_euler
-            aver_normal.rotate(eul_obj_rot)
-        
-        return aver_normal
-
-    def multiAverageNormal(self, obj, is_global):
-        select_face = []
-        avr_normal_list = []
-        bm = self.getBMesh(obj.data)
-        select_face = self.getSelectedFaces(bm)
-
-        eul_obj_rot = obj.rotation_euler
-        for face in select_face:
-            aver_normal = Vector((face.normal.x, face.normal.y, face.normal.z))
-            aver_normal.normalize()
-            if is_global == True:
-                aver_normal.rotate(eul_obj_rot)
-            avr_normal_list.append(aver_normal)
-
-        return avr_normal_list
-
-    def applyObjInfoToVector(self, vect, obj):
-        obj_loc = obj.location
-        obj_rot = obj.rotation_euler
-        obj_scl = obj.scale
-
-        apply_vect = vect
-        apply_vect.rotate(obj_rot)
-        for i in range(0,3):
-            apply_vect[i] *= obj_scl[i]
-            apply_vect[i] += obj_loc[i]
-
-        return apply_vect
-
-    def getGlobalCenterPoint(self, obj):
-        mesh_point = self.getMeshCenterPoint(obj.data)
-        vect_mesh = self.applyObjInfoToVector(Vector(mesh_point), obj)
-
-        return (vect_mesh[0], vect_mesh[1], vect_mesh[2])
-
-    def getMultiGlobalCenterPoint(self, obj):
-        multi_center_list = []
-        select_face_center = []
-        bm = self.getBMesh(obj.data)
-
-        for face in bm.faces:
-            if face.select == True:
-                select_face_center.append(face.calc_center_median())
-
-        for face_center in select_face_center:
-            vect_mesh = self.applyObjInfoToVector(face_center, obj)
-            multi_center_list.append((vect_mesh[0], 
-                                      vect_mesh[1],
-                                      vect_mesh[2]))
-
-        return multi_center_list
-
-    def getMeshCenterPoint(self, mesh):
-        average_x = 0.
-        average_y = 0.
-        average_z = 0.
-        select_face = []
-        bm = self.getBMesh(mesh)
-        
-        select_face = self.getSelectedFaces(bm)
-        face_num = len(select_face)
-
-        for face in select_face:
-            vect = face.calc_center_median()
-            average_x += vect.x
-            average_y += vect.y
-            average_z += vect.z
-        
-        average_x /= (face_num * 1.0)
-        average_y /= (face_num * 1.0)
-        average_z /= (face_num * 1.0)
-
-        return (average_x, average_y, average_z)
-
@@ -0,0 +1,786 @@
+############################################################################
+#
+# adhesion_core.py
+#
+# Copyright (C) 2018 chaosdesk
+#
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.#
+#
+# ##### END GPL LICENSE BLOCK #####
+#
+############################################################################
+
+# Geometry of the mesh adhesion on plain NumPy arrays.
+# This module must not import bpy, bmesh or mathutils so that it can be
+# used headless, e.g. for benchmarks and batch processing.
+
+import itertools
+
+import numpy as np
+
+try:
+    from . import profiling
+except ImportError:
+    import profiling
+
+
+def normalizeRows(vecs):
+    lengths = np.linalg.norm(vecs, axis=1)
+    lengths[lengths == 0.0] = 1.0
+    return vecs / lengths[:, np.newaxis]
+
+
+def eulerToMatrix(euler):
+    # Rotation matrix of XYZ euler angles, same order as Blender's rotation_euler
+    cos_x, cos_y, cos_z = np.cos(euler)
+    sin_x, sin_y, sin_z = np.sin(euler)
+    return np.array(((cos_y * cos_z, sin_x * sin_y * cos_z - cos_x * sin_z, cos_x * sin_y * cos_z + sin_x * sin_z),
+                     (cos_y * sin_z, sin_x * sin_y * sin_z + cos_x * cos_z, cos_x * sin_y * sin_z - sin_x * cos_z),
+                     (-sin_y, sin_x * cos_y, cos_x * cos_y)))
+
+
+def rotationDifference(vec_from, vecs_to):
+    # Quaternions (w, x, y, z) rotating vec_from onto each row of vecs_to
+    quats = np.zeros((len(vecs_to), 4))
+    quats[:, 0] = 1.0
+    if np.linalg.norm(vec_from) == 0.0:
+        return quats
+    vec_from = vec_from / np.linalg.norm(vec_from)
+    vecs_to = normalizeRows(vecs_to)
+
+    quats[:, 0] = 1.0 + vecs_to.dot(vec_from)
+    quats[:, 1:] = np.cross(vec_from, vecs_to)
+
+    # Opposite vectors rotate 180 degrees around any orthogonal axis
+    opposite = quats[:, 0] < 1.0e-6
+    if opposite.any():
+        axis = np.zeros(3)
+        axis[np.argmin(np.abs(vec_from))] = 1.0
+        axis = np.cross(vec_from, axis)
+        quats[opposite, 0] = 0.0
+        quats[opposite, 1:] = axis / np.linalg.norm(axis)
+
+    quats /= np.linalg.norm(quats, axis=1)[:, np.newaxis]
+    return quats
+
+
+def rotateByQuaternion(quats, vecs):
+    # Rotate each row of vecs by the quaternion in the same row
+    quat_w = quats[:, 0:1]
+    quat_v = quats[:, 1:]
+    cross_v = np.cross(quat_v, vecs)
+    return vecs + 2.0 * (quat_w * cross_v + np.cross(quat_v, cross_v))
+
+
+def quaternionToMatrix(quats):
+    # (N,3,3) rotation matrices of the quaternions
+    w, x, y, z = quats[:, 0], quats[:, 1], quats[:, 2], quats[:, 3]
+    mats = np.empty((len(quats), 3, 3))
+    mats[:, 0, 0] = 1.0 - 2.0 * (y * y + z * z)
+    mats[:, 0, 1] = 2.0 * (x * y - w * z)
+    mats[:, 0, 2] = 2.0 * (x * z + w * y)
+    mats[:, 1, 0] = 2.0 * (x * y + w * z)
+    mats[:, 1, 1] = 1.0 - 2.0 * (x * x + z * z)
+    mats[:, 1, 2] = 2.0 * (y * z - w * x)
+    mats[:, 2, 0] = 2.0 * (x * z - w * y)
+    mats[:, 2, 1] = 2.0 * (y * z + w * x)
+    mats[:, 2, 2] = 1.0 - 2.0 * (x * x + y * y)
+    return mats
+
+
+def matrixToQuaternion(mats):
+    # Quaternions (w, x, y, z) of (N,3,3) rotation matrices
+    mats = np.asarray(mats, dtype=np.float64).reshape(-1, 3, 3)
+    quats = np.empty((len(mats), 4))
+    quats[:, 0] = 1.0 + mats[:, 0, 0] + mats[:, 1, 1] + mats[:, 2, 2]
+    quats[:, 1] = 1.0 + mats[:, 0, 0] - mats[:, 1, 1] - mats[:, 2, 2]
+    quats[:, 2] = 1.0 - mats[:, 0, 0] + mats[:, 1, 1] - mats[:, 2, 2]
+    quats[:, 3] = 1.0 - mats[:, 0, 0] - mats[:, 1, 1] + mats[:, 2, 2]
+    quats = np.sqrt(np.maximum(quats, 0.0)) * 0.5
+
+    # Take the signs from the largest component to stay stable
+    largest = np.argmax(quats, axis=1)
+    sign = np.empty((len(mats), 4))
+    sign[:, 0] = 1.0
+    sign[:, 1] = np.sign(mats[:, 2, 1] - mats[:, 1, 2])
+    sign[:, 2] = np.sign(mats[:, 0, 2] - mats[:, 2, 0])
+    sign[:, 3] = np.sign(mats[:, 1, 0] - mats[:, 0, 1])
+    pair_x = np.sign(mats[:, 0, 1] + mats[:, 1, 0])
+    pair_y = np.sign(mats[:, 0, 2] + mats[:, 2, 0])
+    pair_z = np.sign(mats[:, 1, 2] + mats[:, 2, 1])
+    ones = np.ones(len(mats))
+    rows = largest == 1
+    sign[rows] = np.stack((sign[rows, 1], ones[rows], pair_x[rows], pair_y[rows]), axis=-1)
+    rows = largest == 2
+    sign[rows] = np.stack((sign[rows, 2], pair_x[rows], ones[rows], pair_z[rows]), axis=-1)
+    rows = largest == 3
+    sign[rows] = np.stack((sign[rows, 3], pair_y[rows], pair_z[rows], ones[rows]), axis=-1)
+    sign[sign == 0.0] = 1.0
+
+    return normalizeRows(quats * sign)
+
+
+def multiplyQuaternion(quat_a, quats_b):
+    # Hamilton product of quat_a with each row of quats_b
+    w1, x1, y1, z1 = quat_a
+    w2, x2, y2, z2 = quats_b[:, 0], quats_b[:, 1], quats_b[:, 2], quats_b[:, 3]
+    return np.stack((w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2,
+                     w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+                     w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2,
+                     w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2), axis=-1)
+
+
+def quaternionToEuler(quats):
+    # XYZ euler angles, same order as Blender's rotation_euler
+    w, x, y, z = quats[:, 0], quats[:, 1], quats[:, 2], quats[:, 3]
+    eulers = np.empty((len(quats), 3))
+    eulers[:, 0] = np.arctan2(2.0 * (w * x + y * z), 1.0 - 2.0 * (x * x + y * y))
+    eulers[:, 1] = np.arcsin(np.clip(2.0 * (w * y - z * x), -1.0, 1.0))
+    eulers[:, 2] = np.arctan2(2.0 * (w * z + x * y), 1.0 - 2.0 * (y * y + z * z))
+    return eulers
+
+
+class Transform():
+    # Object transform given as a 4x4 matrix, e.g. Blender's matrix_world
+    def __init__(self, matrix=None):
+        if matrix is None:
+            matrix = np.identity(4)
+        self.matrix = np.asarray(matrix, dtype=np.float64).reshape(4, 4)
+        self.normal_matrix = None
+
+    @classmethod
+    def fromEuler(cls, location=(0.0, 0.0, 0.0), rotation=(0.0, 0.0, 0.0),
+                  scale=(1.0, 1.0, 1.0)):
+        # Same order as Blender: scale, then rotate, then translate
+        matrix = np.identity(4)
+        matrix[:3, :3] = eulerToMatrix(np.asarray(rotation, dtype=np.float64)) * \
+            np.asarray(scale, dtype=np.float64)
+        matrix[:3, 3] = location
+        return cls(matrix)
+
+    def applyToPoints(self, points):
+        # Affine part of the 4x4 matrix applied to every row at once
+        return points.dot(self.matrix[:3, :3].T) + self.matrix[:3, 3]
+
+    def applyToNormals(self, normals):
+        # Normals use the inverse transpose, so non-uniform scale keeps
+        # them perpendicular to the faces
+        if self.normal_matrix is None:
+            self.normal_matrix = np.linalg.inv(self.matrix[:3, :3]).T
+        if normals.ndim == 1:
+            return normalizeRows(normals.dot(self.normal_matrix.T)[np.newaxis])[0]
+        return normalizeRows(normals.dot(self.normal_matrix.T))
+
+    def applyToVectors(self, vecs):
+        # Directions along the surface, e.g. tangents, normalized
+        return normalizeRows(vecs.dot(self.matrix[:3, :3].T))
+
+    def inverted(self):
+        return Transform(np.linalg.inv(self.matrix))
+
+
+class MeshArrays():
+    # Polygon mesh in the layout of Blender's vertices, loops and polygons.
+    # uv_layers and color_layers are (name, (L,K) array) pairs and
+    # loop_normals the (L,3) custom split normals, all per loop.
+    def __init__(self, verts, loop_verts, loop_start, loop_total,
+                 mat_index=None, smooth=None, vert_normals=None,
+                 uv_layers=(), color_layers=(), loop_normals=None):
+        self.verts = np.asarray(verts, dtype=np.float64).reshape(-1, 3)
+        self.loop_verts = np.asarray(loop_verts, dtype=np.int64).ravel()
+        self.loop_start = np.asarray(loop_start, dtype=np.int64).ravel()
+        self.loop_total = np.asarray(loop_total, dtype=np.int64).ravel()
+        self.mat_index = mat_index
+        self.smooth = smooth
+        self.vert_normals = vert_normals
+        self.uv_layers = list(uv_layers)
+        self.color_layers = list(color_layers)
+        self.loop_normals = loop_normals
+
+    def faceCount(self):
+        return len(self.loop_start)
+
+    def loopNext(self):
+        # Index of the following loop of the same face for every loop
+        loop_next = np.arange(len(self.loop_verts)) + 1
+        loop_next[self.loop_start + self.loop_total - 1] = self.loop_start
+        return loop_next
+
+    def subset(self, indices):
+        # The given faces only, sharing all vertices
+        loop_total = self.loop_total[indices]
+        loop_start = np.zeros(len(indices), dtype=np.int64)
+        np.cumsum(loop_total[:-1], out=loop_start[1:])
+        loop_index = np.repeat(self.loop_start[indices] - loop_start, loop_total) + \
+            np.arange(loop_total.sum())
+
+        mat_index = None
+        if self.mat_index is not None:
+            mat_index = self.mat_index[indices]
+        smooth = None
+        if self.smooth is not None:
+            smooth = self.smooth[indices]
+        loop_normals = None
+        if self.loop_normals is not None:
+            loop_normals = self.loop_normals[loop_index]
+        return MeshArrays(self.verts, self.loop_verts[loop_index], loop_start, loop_total,
+                          mat_index, smooth, self.vert_normals,
+                          [(name, layer[loop_index]) for name, layer in self.uv_layers],
+                          [(name, layer[loop_index]) for name, layer in self.color_layers],
+                          loop_normals)
+
+    def fanTriangles(self):
+        # Loop indices (T,3) of a fan triangulation and the face of each triangle
+        tri_total = np.maximum(self.loop_total - 2, 0)
+        tri_face = np.repeat(np.arange(self.faceCount()), tri_total)
+        tri_first = np.zeros(len(tri_total), dtype=np.int64)
+        np.cumsum(tri_total[:-1], out=tri_first[1:])
+        tri_step = np.arange(tri_total.sum()) - np.repeat(tri_first, tri_total)
+
+        tri_loops = np.empty((len(tri_face), 3), dtype=np.int64)
+        tri_loops[:, 0] = self.loop_start[tri_face]
+        tri_loops[:, 1] = tri_loops[:, 0] + tri_step + 1
+        tri_loops[:, 2] = tri_loops[:, 0] + tri_step + 2
+        return tri_loops, tri_face
+
+    def faceAttributes(self):
+        # Normals and areas by Newell's method, centers as vertex means
+        face_num = self.faceCount()
+        loop_co = self.verts[self.loop_verts]
+        loop_face = np.repeat(np.arange(face_num), self.loop_total)
+        cross = np.cross(loop_co, loop_co[self.loopNext()])
+
+        newell = np.empty((face_num, 3))
+        centers = np.empty((face_num, 3))
+        for i in range(0, 3):
+            newell[:, i] = np.bincount(loop_face, cross[:, i], face_num)
+            centers[:, i] = np.bincount(loop_face, loop_co[:, i], face_num)
+        centers /= self.loop_total[:, np.newaxis]
+
+        lengths = np.linalg.norm(newell, axis=1)
+        areas = lengths * 0.5
+        lengths[lengths == 0.0] = 1.0
+        normals = newell / lengths[:, np.newaxis]
+
+        return normals, areas, centers
+
+    def edgeTangents(self, longest=True):
+        # Unit direction of the longest, or else the first, edge of each face
+        edges = self.verts[self.loop_verts[self.loopNext()]] - self.verts[self.loop_verts]
+        if not longest:
+            return normalizeRows(edges[self.loop_start])
+
+        # Loops grouped by face, longest edge first, ties keep loop order
+        loop_face = np.repeat(np.arange(self.faceCount()), self.loop_total)
+        order = np.lexsort((-(edges * edges).sum(axis=1), loop_face))
+        face_first = np.zeros(self.faceCount(), dtype=np.int64)
+        np.cumsum(self.loop_total[:-1], out=face_first[1:])
+        return normalizeRows(edges[order[face_first]])
+
+    def faceIslands(self):
+        # Island index of every face, faces sharing an edge are connected
+        face_num = self.faceCount()
+        loop_face = np.repeat(np.arange(face_num), self.loop_total)
+        vert_a = self.loop_verts
+        vert_b = self.loop_verts[self.loopNext()]
+        edge_keys = np.minimum(vert_a, vert_b) * (len(self.verts) + 1) + np.maximum(vert_a, vert_b)
+
+        # Loops of the same edge are neighbours once sorted by edge
+        order = np.argsort(edge_keys, kind="mergesort")
+        shared = np.flatnonzero(edge_keys[order[1:]] == edge_keys[order[:-1]])
+        pairs_a = loop_face[order[shared]].tolist()
+        pairs_b = loop_face[order[shared + 1]].tolist()
+
+        # Union-find with path halving over the shared edges
+        parent = list(range(face_num))
+        for face_a, face_b in zip(pairs_a, pairs_b):
+            while parent[face_a] != face_a:
+                parent[face_a] = parent[parent[face_a]]
+                face_a = parent[face_a]
+            while parent[face_b] != face_b:
+                parent[face_b] = parent[parent[face_b]]
+                face_b = parent[face_b]
+            if face_a != face_b:
+                parent[max(face_a, face_b)] = min(face_a, face_b)
+
+        roots = np.array(parent, dtype=np.int64)
+        while True:
+            next_roots = roots[roots]
+            if np.array_equal(next_roots, roots):
+                break
+            roots = next_roots
+        return np.unique(roots, return_inverse=True)[1]
+
+
+class FaceData():
+    # Selected faces of a mesh in its local space
+    def __init__(self, indices, normals, areas, centers):
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.normals = np.asarray(normals, dtype=np.float64).reshape(-1, 3)
+        self.areas = np.asarray(areas, dtype=np.float64)
+        self.centers = np.asarray(centers, dtype=np.float64).reshape(-1, 3)
+
+    @classmethod
+    def fromMesh(cls, mesh_arrays, select=None):
+        normals, areas, centers = mesh_arrays.faceAttributes()
+        if select is None:
+            indices = np.arange(mesh_arrays.faceCount())
+        else:
+            indices = np.flatnonzero(select)
+        return cls(indices, normals[indices], areas[indices], centers[indices])
+
+    def count(self):
+        return len(self.indices)
+
+    def averageNormal(self):
+        # Area weighted sum of the face normals
+        aver_normal = np.dot(self.areas, self.normals)
+        length = np.linalg.norm(aver_normal)
+        if length != 0.0:
+            aver_normal /= length
+        return aver_normal
+
+    def faceNormals(self):
+        return normalizeRows(self.normals)
+
+    def centerPoint(self):
+        return self.centers.mean(axis=0)
+
+    def chunks(self, chunk_size):
+        # Consecutive views of at most chunk_size faces, nothing is copied
+        for start in range(0, self.count(), chunk_size):
+            stop = start + chunk_size
+            yield FaceData(self.indices[start:stop], self.normals[start:stop],
+                           self.areas[start:stop], self.centers[start:stop])
+
+    def islandAverages(self, labels):
+        # averageNormal and centerPoint of the faces of each island
+        island_num = int(labels.max()) + 1 if len(labels) > 0 else 0
+        normals = np.empty((island_num, 3))
+        centers = np.empty((island_num, 3))
+        face_num = np.bincount(labels, minlength=island_num)
+        for i in range(0, 3):
+            normals[:, i] = np.bincount(labels, self.areas * self.normals[:, i], island_num)
+            centers[:, i] = np.bincount(labels, self.centers[:, i], island_num)
+        centers /= face_num[:, np.newaxis]
+        return normalizeRows(normals), centers
+
+
+class Placements():
+    # Rotation, world location and rotated offset of every copy, and the
+    # target face each copy sits on when there is one
+    def __init__(self, quats, locations, offsets=None, faces=None):
+        self.quats = quats
+        self.locations = locations
+        self.offsets = offsets
+        self.faces = faces
+
+    def count(self):
+        return len(self.quats)
+
+    def eulers(self):
+        return quaternionToEuler(self.quats)
+
+    def worldLocations(self):
+        if self.offsets is None:
+            return self.locations
+        return self.locations + self.offsets
+
+    def subset(self, mask):
+        offsets = None
+        if self.offsets is not None:
+            offsets = self.offsets[mask]
+        faces = None
+        if self.faces is not None:
+            faces = self.faces[mask]
+        return Placements(self.quats[mask], self.locations[mask], offsets, faces)
+
+    def toParentSpace(self, parent_matrix):
+        # Placements relative to a parent with the given world matrix
+        inv_transform = Transform(parent_matrix).inverted()
+        # The inverse of R S is S^-1 R^T, so the scale comes off its rows
+        inv_rotation = inv_transform.matrix[:3, :3]
+        inv_rotation = inv_rotation / np.linalg.norm(inv_rotation, axis=1)[:, np.newaxis]
+        inv_quat = matrixToQuaternion(inv_rotation)[0]
+
+        offsets = None
+        if self.offsets is not None:
+            offsets = self.offsets.dot(inv_transform.matrix[:3, :3].T)
+        return Placements(multiplyQuaternion(inv_quat, self.quats),
+                          inv_transform.applyToPoints(self.locations), offsets, self.faces)
+
+
+def concatPlacements(placements_list):
+    # One Placements holding the copies of all given ones in order
+    quats = np.concatenate([placements.quats for placements in placements_list])
+    locations = np.concatenate([placements.locations for placements in placements_list])
+    offsets = None
+    if all(placements.offsets is not None for placements in placements_list):
+        offsets = np.concatenate([placements.offsets for placements in placements_list])
+    faces = None
+    if all(placements.faces is not None for placements in placements_list):
+        faces = np.concatenate([placements.faces for placements in placements_list])
+    return Placements(quats, locations, offsets, faces)
+
+
+class PlacementStream():
+    # A known number of placements produced chunk by chunk, so that only
+    # one chunk is in memory at a time. It can be iterated once.
+    def __init__(self, count, chunks):
+        self.place_num = count
+        self.chunk_iter = chunks
+
+    def count(self):
+        return self.place_num
+
+    def chunks(self):
+        return self.chunk_iter
+
+
+def solvePlacements(src_normal, src_center, src_scale, dst_normals, dst_centers, offset):
+    # The source normal as seen after its scale, then flipped to face the target
+    src_scale = np.asarray(src_scale, dtype=np.float64)
+    vector_inv_src = np.asarray(src_normal, dtype=np.float64) / src_scale * -1.0
+    quats = rotationDifference(vector_inv_src, dst_normals)
+    return placeRotations(quats, src_center, src_scale, dst_centers, offset)
+
+
+def orthoFrames(normals, tangents):
+    # (N,3,3) right handed frames with the columns normal, tangent, bitangent
+    normals = normalizeRows(normals)
+    tangents = tangents - normals * (tangents * normals).sum(axis=1)[:, np.newaxis]
+
+    # Tangents along the normal fall back to another axis
+    degenerate = np.linalg.norm(tangents, axis=1) < 1.0e-6
+    if degenerate.any():
+        axes = np.where(np.abs(normals[degenerate, :1]) < 0.9, [[1.0, 0.0, 0.0]],
+                        [[0.0, 1.0, 0.0]])
+        tangents[degenerate] = axes - normals[degenerate] * \
+            (axes * normals[degenerate]).sum(axis=1)[:, np.newaxis]
+    tangents = normalizeRows(tangents)
+
+    return np.stack((normals, tangents, np.cross(normals, tangents)), axis=-1)
+
+
+def solveFramePlacements(src_normal, src_tangent, src_center, src_scale,
+                         dst_normals, dst_tangents, dst_centers, offset):
+    # Like solvePlacements, with the source tangent turned onto the target
+    # tangents so that the spin around the normal is fixed
+    src_scale = np.asarray(src_scale, dtype=np.float64)
+    src_frame = orthoFrames((np.asarray(src_normal, dtype=np.float64) / src_scale *
+                             -1.0)[np.newaxis],
+                            (np.asarray(src_tangent, dtype=np.float64) * src_scale)[np.newaxis])
+    quats = matrixToQuaternion(np.matmul(orthoFrames(dst_normals, dst_tangents),
+                                         src_frame[0].T))
+    return placeRotations(quats, src_center, src_scale, dst_centers, offset)
+
+
+def placeRotations(quats, src_center, src_scale, dst_centers, offset):
+    # Every copy shares the scaled local center of the source mesh
+    src_centers = np.tile(np.asarray(src_center, dtype=np.float64) * src_scale,
+                          (len(quats), 1))
+    locations = dst_centers - rotateByQuaternion(quats, src_centers)
+
+    offsets = None
+    if offset[0] != 0.0 or offset[1] != 0.0 or offset[2] != 0.0:
+        offsets = rotateByQuaternion(quats, np.tile(np.asarray(offset, dtype=np.float64),
+                                                    (len(quats), 1)))
+
+    return Placements(quats, locations, offsets)
+
+
+def singleAdhesion(dst_faces, dst_transform, src_faces, src_scale, offset):
+    # One copy on the center of all selected faces
+    dst_normal = dst_transform.applyToNormals(dst_faces.averageNormal()[np.newaxis])
+    dst_center = dst_transform.applyToPoints(dst_faces.centerPoint()[np.newaxis])
+    return solvePlacements(src_faces.averageNormal(), src_faces.centerPoint(), src_scale,
+                           dst_normal, dst_center, offset)
+
+
+def iterMultipleAdhesion(dst_faces, dst_transform, src_faces, src_scale, offset,
+                         chunk_size=65536, tangents=None, profiler=profiling.NULL_PROFILER):
+    # One copy on each selected face, as stages over chunks of the faces:
+    # extract a view, transform it and solve it, so the temporaries are
+    # bounded by the chunk size instead of the selection. When given,
+    # tangents(start, count) returns the world tangents of count faces from
+    # start for the local X axis of the source to follow.
+    src_normal = src_faces.averageNormal()
+    src_center = src_faces.centerPoint()
+    chunks = dst_faces.chunks(chunk_size)
+    for start, chunk in zip(itertools.count(0, chunk_size), chunks):
+        face_num = chunk.count()
+        with profiler.phase("normal", face_num):
+            dst_normals = dst_transform.applyToNormals(chunk.faceNormals())
+        with profiler.phase("center", face_num):
+            dst_centers = dst_transform.applyToPoints(chunk.centers)
+        with profiler.phase("solve", face_num):
+            if tangents is None:
+                placements = solvePlacements(src_normal, src_center, src_scale,
+                                             dst_normals, dst_centers, offset)
+            else:
+                placements = solveFramePlacements(src_normal, (1.0, 0.0, 0.0), src_center,
+                                                  src_scale, dst_normals,
+                                                  tangents(start, face_num),
+                                                  dst_centers, offset)
+        placements.faces = chunk.indices
+        yield placements
+
+
+def assignSources(face_num, source_num, mode, seed=0, start=0, face_keys=None,
+                  key_sources=None):
+    # Source index of every face, -1 where no source fits the face.
+    # MATERIAL looks up key_sources with the key of each face.
+    if mode == "RANDOM":
+        return np.random.RandomState(seed).randint(0, source_num, face_num)
+    elif mode == "MATERIAL":
+        face_keys = np.array(face_keys, dtype=np.int64)
+        key_sources = np.append(np.asarray(key_sources, dtype=np.int64), -1)
+        face_keys[(face_keys < 0) | (face_keys >= len(key_sources) - 1)] = -1
+        return key_sources[face_keys]
+    return (np.arange(face_num) + start) % source_num
+
+
+def multiSourceAdhesion(dst_faces, dst_transform, sources, assign, offset,
+                        dst_tangents=None):
+    # iterMultipleAdhesion with the source of every face chosen by assign from
+    # the (src_faces, src_scale) pairs of sources, one Placements each.
+    # With world dst_tangents the local X axis of each source follows them.
+    dst_normals = dst_transform.applyToNormals(dst_faces.faceNormals())
+    dst_centers = dst_transform.applyToPoints(dst_faces.centers)
+
+    placements_list = []
+    for index, (src_faces, src_scale) in enumerate(sources):
+        mask = assign == index
+        if dst_tangents is None:
+            placements = solvePlacements(src_faces.averageNormal(), src_faces.centerPoint(),
+                                         src_scale, dst_normals[mask], dst_centers[mask],
+                                         offset)
+        else:
+            placements = solveFramePlacements(src_faces.averageNormal(), (1.0, 0.0, 0.0),
+                                              src_faces.centerPoint(), src_scale,
+                                              dst_normals[mask], dst_tangents[mask],
+                                              dst_centers[mask], offset)
+        placements.faces = dst_faces.indices[mask]
+        placements_list.append(placements)
+    return placements_list
+
+
+def islandAdhesion(dst_mesh, dst_faces, dst_transform, src_faces, src_scale, offset):
+    # One copy on the center of each edge connected island of dst_faces,
+    # with dst_mesh holding the same faces in the same order
+    normals, centers = dst_faces.islandAverages(dst_mesh.faceIslands())
+    return solvePlacements(src_faces.averageNormal(), src_faces.centerPoint(), src_scale,
+                           dst_transform.applyToNormals(normals),
+                           dst_transform.applyToPoints(centers), offset)
+
+
+def scatterSamples(tri_verts, tri_normals, count, seed):
+    # Area weighted random points on (T,3,3) triangles with interpolated normals
+    edge_a = tri_verts[:, 1] - tri_verts[:, 0]
+    edge_b = tri_verts[:, 2] - tri_verts[:, 0]
+    cumulative_area = np.cumsum(np.linalg.norm(np.cross(edge_a, edge_b), axis=1))
+
+    random = np.random.RandomState(seed)
+    picks = np.searchsorted(cumulative_area,
+                            random.random_sample(count) * cumulative_area[-1], side="right")
+    picks = np.minimum(picks, len(tri_verts) - 1)
+
+    # Uniform barycentric coordinates
+    root_u = np.sqrt(random.random_sample(count))
+    rand_v = random.random_sample(count)
+    bary = np.stack((1.0 - root_u, root_u * (1.0 - rand_v), root_u * rand_v), axis=-1)
+
+    points = np.einsum("ni,nij->nj", bary, tri_verts[picks])
+    normals = normalizeRows(np.einsum("ni,nij->nj", bary, tri_normals[picks]))
+    return points, normals
+
+
+def scatterAdhesion(dst_mesh, dst_transform, src_faces, src_scale, offset, count, seed):
+    # Copies scattered over all faces of dst_mesh by area
+    tri_loops, tri_face = dst_mesh.fanTriangles()
+    tri_vert_index = dst_mesh.loop_verts[tri_loops]
+    world_verts = dst_transform.applyToPoints(dst_mesh.verts)
+    tri_verts = world_verts[tri_vert_index]
+
+    # Smooth faces interpolate vertex normals, flat faces keep their own
+    edge_cross = np.cross(tri_verts[:, 1] - tri_verts[:, 0], tri_verts[:, 2] - tri_verts[:, 0])
+    tri_normals = np.repeat(normalizeRows(edge_cross)[:, np.newaxis, :], 3, axis=1)
+    if dst_mesh.smooth is not None and dst_mesh.vert_normals is not None:
+        smooth_tri = np.asarray(dst_mesh.smooth, dtype=bool)[tri_face]
+        world_normals = dst_transform.applyToNormals(
+            np.asarray(dst_mesh.vert_normals, dtype=np.float64).reshape(-1, 3))
+        tri_normals[smooth_tri] = world_normals[tri_vert_index[smooth_tri]]
+
+    points, normals = scatterSamples(tri_verts, tri_normals, count, seed)
+    return solvePlacements(src_faces.averageNormal(), src_faces.centerPoint(), src_scale,
+                           normals, points, offset)
+
+
+def boundingRadius(verts, center, scale):
+    # Radius of the sphere around the scaled center holding every vertex
+    if len(verts) == 0:
+        return 0.0
+    scaled = (np.asarray(verts) - np.asarray(center)) * np.asarray(scale)
+    return float(np.sqrt((scaled * scaled).sum(axis=1).max()))
+
+
+class OverlapCuller():
+    # Keeps points in order unless a kept point is closer than spacing.
+    # Kept points stay in a uniform hash grid with cells of the spacing,
+    # so later calls see the points of earlier ones and the search is
+    # limited to the 27 neighbouring cells, about linear in the points.
+    def __init__(self, spacing):
+        self.spacing = spacing
+        self.grid = {}
+
+    def cull(self, points):
+        keep = np.ones(len(points), dtype=bool)
+        if self.spacing <= 0.0 or len(points) == 0:
+            return keep
+
+        spacing_sq = self.spacing * self.spacing
+        cells = np.floor(points / self.spacing).astype(np.int64).tolist()
+        neighbours = [(x, y, z) for x in (-1, 0, 1) for y in (-1, 0, 1) for z in (-1, 0, 1)]
+        grid = self.grid
+        for index, (point, cell) in enumerate(zip(points.tolist(), cells)):
+            conflict = False
+            for near_x, near_y, near_z in neighbours:
+                for other in grid.get((cell[0] + near_x, cell[1] + near_y, cell[2] + near_z),
+                                      ()):
+                    dist_x = point[0] - other[0]
+                    dist_y = point[1] - other[1]
+                    dist_z = point[2] - other[2]
+                    if dist_x * dist_x + dist_y * dist_y + dist_z * dist_z < spacing_sq:
+                        conflict = True
+                        break
+                if conflict:
+                    break
+
+            if conflict:
+                keep[index] = False
+            else:
+                grid.setdefault(tuple(cell), []).append(point)
+
+        return keep
+
+
+def cullPlacements(placements, src_center, src_scale, culler):
+    # Drop copies whose centers are closer than the culler's spacing to an
+    # earlier copy, of this or an earlier call
+    centers = placePoints(placements, [src_center], src_scale)[:, 0]
+    if placements.offsets is not None:
+        centers += placements.offsets
+    keep = culler.cull(centers)
+    return placements.subset(keep), int(len(keep) - keep.sum())
+
+
+def placePoints(placements, points, scale):
+    # (N,K,3) world positions of local source points for every placement
+    points = np.asarray(points, dtype=np.float64) * np.asarray(scale)
+    mats_rot = quaternionToMatrix(placements.quats)
+    return np.matmul(points, mats_rot.transpose(0, 2, 1)) + \
+        placements.locations[:, np.newaxis, :]
+
+
+def footprintPoints(mesh_arrays, indices):
+    # Vertices and centers of the given faces
+    face_num = mesh_arrays.faceCount()
+    loop_face = np.repeat(np.arange(face_num), mesh_arrays.loop_total)
+    face_mask = np.zeros(face_num, dtype=bool)
+    face_mask[indices] = True
+    vert_indices = np.unique(mesh_arrays.loop_verts[face_mask[loop_face]])
+    centers = mesh_arrays.faceAttributes()[2][indices]
+    return np.concatenate((mesh_arrays.verts[vert_indices], centers))
+
+
+def projectedAdhesion(dst_faces, dst_transform, src_faces, src_footprint, src_scale,
+                      offset, raycast):
+    # One copy cast along the averaged normal onto the target surface.
+    # raycast(points, direction) returns the world hit points and hit
+    # normals of rays through the points, with NaN rows where rays missed.
+    dst_normal = dst_transform.applyToNormals(dst_faces.averageNormal()[np.newaxis])
+    dst_center = dst_transform.applyToPoints(dst_faces.centerPoint()[np.newaxis])
+    hits, hit_normals = raycast(dst_center, dst_normal[0] * -1.0)
+    if not np.isnan(hits).any():
+        dst_center = hits
+        dst_normal = normalizeRows(hit_normals)
+
+    placements = solvePlacements(src_faces.averageNormal(), src_faces.centerPoint(), src_scale,
+                                 dst_normal, dst_center, offset)
+
+    # Lower the copy until its deepest footprint point touches the surface
+    footprint = placePoints(placements, src_footprint, src_scale)[0]
+    hits, hit_normals = raycast(footprint, dst_normal[0] * -1.0)
+    heights = (footprint - hits).dot(dst_normal[0])
+    heights = heights[~np.isnan(heights)]
+    if len(heights) > 0:
+        placements.locations = placements.locations - dst_normal * heights.min()
+
+    return placements
+
+
+def instanceTriangles(placements, size):
+    # One triangle per placement, centered on it, facing the rotated normal
+    # and with its first edge along the rotated x axis
+    place_num = placements.count()
+    locations = placements.worldLocations()
+    tri_local = np.array(((0.0, 0.0, 0.0), (1.0, 0.0, 0.0), (0.0, 1.0, 0.0)))
+    tri_local -= tri_local.mean(axis=0)
+    tri_local *= size
+
+    tri_verts = np.empty((place_num, 3, 3))
+    for i in range(0, 3):
+        tri_local_i = np.tile(tri_local[i], (place_num, 1))
+        tri_verts[:, i] = locations + rotateByQuaternion(placements.quats, tri_local_i)
+    return tri_verts
+
+
+def tileMesh(mesh_arrays, placements, scale):
+    # Copy of the mesh for every placement, transformed by one batched multiply
+    place_num = placements.count()
+    vert_num = len(mesh_arrays.verts)
+    loop_num = len(mesh_arrays.loop_verts)
+
+    verts = mesh_arrays.verts * np.asarray(scale)
+    mats_rot = quaternionToMatrix(placements.quats)
+    tile_verts = np.matmul(verts, mats_rot.transpose(0, 2, 1))
+    tile_verts += placements.worldLocations()[:, np.newaxis, :]
+
+    tile_loop_verts = mesh_arrays.loop_verts + (np.arange(place_num) * vert_num)[:, np.newaxis]
+    tile_loop_start = mesh_arrays.loop_start + (np.arange(place_num) * loop_num)[:, np.newaxis]
+
+    mat_index = None
+    if mesh_arrays.mat_index is not None:
+        mat_index = np.tile(mesh_arrays.mat_index, place_num)
+    smooth = None
+    if mesh_arrays.smooth is not None:
+        smooth = np.tile(mesh_arrays.smooth, place_num)
+
+    # Loop layers repeat as they are, split normals turn with each copy
+    uv_layers = [(name, np.tile(layer, (place_num, 1))) for name, layer in mesh_arrays.uv_layers]
+    color_layers = [(name, np.tile(layer, (place_num, 1)))
+                    for name, layer in mesh_arrays.color_layers]
+    loop_normals = None
+    if mesh_arrays.loop_normals is not None:
+        normals = mesh_arrays.loop_normals / np.asarray(scale)
+        loop_normals = normalizeRows(
+            np.matmul(normals, mats_rot.transpose(0, 2, 1)).reshape(-1, 3))
+
+    return MeshArrays(tile_verts, tile_loop_verts, tile_loop_start,
+                      np.tile(mesh_arrays.loop_total, place_num), mat_index, smooth,
+                      uv_layers=uv_layers, color_layers=color_layers,
+                      loop_normals=loop_normals)
@@ -0,0 +1,187 @@
+############################################################################
+#
+# batch_adhesion.py
+#
+# Copyright (C) 2018 chaosdesk
+#
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.#
+#
+# ##### END GPL LICENSE BLOCK #####
+#
+############################################################################
+
+# Multiple adhesion over OBJ/PLY files without Blender.
+#
+#   python batch_adhesion.py target.obj bolt.ply out.obj --material Holes
+#   python batch_adhesion.py --jobs jobs.jsonl --workers 8
+#
+# Every line of a jobs file is a JSON object with the keys target, source,
+# output and optionally mask, material, group, source_mask, offset,
+# include_target and chunk_size. One copy of the source is placed on each
+# selected face of the target, as in AdhereProc.execMultipleAdhesion.
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+try:
+    from . import adhesion_core
+    from . import mesh_io
+    from . import profiling
+except ImportError:
+    import adhesion_core
+    import mesh_io
+    import profiling
+
+
+def readMask(filepath, face_num):
+    # Boolean .npy array, or face indices separated by white space
+    if filepath.endswith(".npy"):
+        mask = np.load(filepath, mmap_mode="r")
+        if mask.dtype == bool:
+            if mask.shape != (face_num,):
+                raise ValueError("%s: mask has %d entries, the mesh has %d faces"
+                                 % (filepath, mask.size, face_num))
+            return np.asarray(mask)
+        indices = np.asarray(mask, dtype=np.int64).ravel()
+    else:
+        # Any white space, loadtxt wants the same count on every line
+        with open(filepath, "r") as mask_file:
+            indices = np.array(mask_file.read().split(), dtype=np.int64)
+
+    if len(indices) > 0 and (indices.min() < 0 or indices.max() >= face_num):
+        raise ValueError("%s: face indices must be in 0 to %d" % (filepath, face_num - 1))
+    select = np.zeros(face_num, dtype=bool)
+    select[indices] = True
+    return select
+
+
+def getSelection(mesh_file, job, prefix=""):
+    face_num = mesh_file.mesh_arrays.faceCount()
+    if job.get(prefix + "mask"):
+        return readMask(job[prefix + "mask"], face_num)
+    elif job.get(prefix + "material"):
+        return mesh_file.selectByMaterial(job[prefix + "material"])
+    elif job.get(prefix + "group"):
+        return mesh_file.selectByGroup(job[prefix + "group"])
+    return None
+
+
+def runJob(job):
+    time_start = time.time()
+    profiling.resetPeakRss()
+    target = mesh_io.readMesh(job["target"])
+    source = mesh_io.readMesh(job["source"])
+
+    dst_faces = adhesion_core.FaceData.fromMesh(target.mesh_arrays, getSelection(target, job))
+    src_faces = adhesion_core.FaceData.fromMesh(source.mesh_arrays,
+                                                getSelection(source, job, "source_"))
+    if src_faces.count() == 0:
+        raise ValueError("%s: faces of the source mesh not selected" % job["source"])
+    if dst_faces.count() == 0:
+        raise ValueError("%s: faces of the target mesh not selected" % job["target"])
+
+    # The normals of a closed source, e.g. all faces of a bolt, cancel out
+    # and every copy would silently keep the rotation of the source
+    normal_sum = np.linalg.norm(np.dot(src_faces.areas, src_faces.normals))
+    if normal_sum <= 1.0e-6 * src_faces.areas.sum():
+        raise ValueError("%s: selected faces of the source mesh have no average normal, "
+                         "select the faces to adhere with a source mask" % job["source"])
+
+    # Placements are solved chunk by chunk while the tiles are written
+    offset = tuple(job.get("offset", (0.0, 0.0, 0.0)))
+    placements = adhesion_core.PlacementStream(
+        dst_faces.count(),
+        adhesion_core.iterMultipleAdhesion(dst_faces, adhesion_core.Transform(), src_faces,
+                                           (1.0, 1.0, 1.0), offset,
+                                           job.get("chunk_size", 65536)))
+
+    base_mesh = None
+    if job.get("include_target"):
+        base_mesh = target.mesh_arrays
+    mesh_io.writeTiles(job["output"], source.mesh_arrays, placements, (1.0, 1.0, 1.0),
+                       base_mesh)
+
+    return {"output": job["output"],
+            "copies": placements.count(),
+            "seconds": time.time() - time_start,
+            "peak_rss": profiling.peakRss()}
+
+
+def readJobs(filepath):
+    jobs = []
+    with open(filepath, "r") as jobs_file:
+        for line in jobs_file:
+            if line.strip():
+                jobs.append(json.loads(line))
+    return jobs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Adhere a source mesh to selected faces "
+                                                 "of target meshes in OBJ/PLY files")
+    parser.add_argument("target", nargs="?")
+    parser.add_argument("source", nargs="?")
+    parser.add_argument("output", nargs="?")
+    parser.add_argument("--jobs", help="JSON lines file with one job per line")
+    parser.add_argument("--mask", help="face indices or boolean .npy of the target selection")
+    parser.add_argument("--material", help="select target faces of this OBJ material")
+    parser.add_argument("--group", help="select target faces of this OBJ group or object")
+    parser.add_argument("--source-mask", help="face selection of the source, all by default, "
+                                              "needed for closed sources")
+    parser.add_argument("--offset", type=float, nargs=3, default=(0.0, 0.0, 0.0))
+    parser.add_argument("--include-target", action="store_true",
+                        help="write the target mesh into the output as well")
+    parser.add_argument("--chunk-size", type=int, default=65536,
+                        help="faces solved at a time, bounds the memory of the placements")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args(argv)
+
+    if args.jobs:
+        jobs = readJobs(args.jobs)
+    elif args.target and args.source and args.output:
+        jobs = [{"target": args.target, "source": args.source, "output": args.output,
+                 "mask": args.mask, "material": args.material, "group": args.group,
+                 "source_mask": args.source_mask, "offset": args.offset,
+                 "include_target": args.include_target, "chunk_size": args.chunk_size}]
+    else:
+        parser.error("give target, source and output files or --jobs")
+
+    ret = 0
+    with ProcessPoolExecutor(max_workers=max(min(args.workers, len(jobs)), 1)) as executor:
+        futures = [executor.submit(runJob, job) for job in jobs]
+        for job, future in zip(jobs, futures):
+            try:
+                result = future.result()
+            except Exception as err:
+                print("failed %s: %s" % (job.get("output"), err), file=sys.stderr)
+                ret = 1
+                continue
+            print("%s: %d copies in %.2fs, peak RSS %s" % (
+                result["output"], result["copies"], result["seconds"],
+                profiling.formatBytes(result["peak_rss"])))
+
+    return ret
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,459 @@
+############################################################################
+#
+# benchmark.py
+#
+# Copyright (C) 2018 chaosdesk
+#
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.#
+#
+# ##### END GPL LICENSE BLOCK #####
+#
+############################################################################
+
+# Scaling benchmark of the adhesion pipeline, runnable without Blender.
+#
+#   python benchmark.py --faces 1000 100000 --density 0.01 1.0 \
+#       --output report.json --baseline baseline.json
+#
+# Every phase is timed separately on synthetic target meshes, and its
+# memory is traced in a separate pass. Outside of Blender, stand-in bpy,
+# bmesh and mathutils modules are installed so that the selection, single
+# adhesion, duplication and transform phases run through AdhereProc itself.
+
+import argparse
+import copy
+import importlib.util
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import types
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import adhesion_core
+
+
+DEFAULT_FACES = (1000, 10000, 100000, 1000000)
+DEFAULT_DENSITY = (0.001, 0.01, 0.1, 1.0)
+PHASES = ("selection", "normal", "center", "single", "duplication", "transform")
+PACKAGE_NAME = "mesh_adhesion_bench"
+
+
+class StandInCollection():
+    # bpy_prop_collection of one array per attribute, read and written
+    # through foreach_get and foreach_set like the real one
+    def __init__(self, **attributes):
+        self.attributes = {name: np.asarray(values) for name, values in attributes.items()}
+        self.length = 0
+        for values in self.attributes.values():
+            self.length = len(values)
+
+    def __len__(self):
+        return self.length
+
+    def add(self, count):
+        self.length += count
+        for name, values in self.attributes.items():
+            grown = np.zeros((self.length,) + values.shape[1:], dtype=values.dtype)
+            grown[:len(values)] = values
+            self.attributes[name] = grown
+
+    def foreach_get(self, name, values):
+        values[:] = self.attributes[name].ravel()
+
+    def foreach_set(self, name, values):
+        values = np.array(values)
+        if values.size != self.length:
+            values = values.reshape(self.length, -1)
+        self.attributes[name] = values
+
+
+class StandInMesh():
+    def __init__(self, name):
+        self.name = name
+        self.is_editmode = False
+        self.vertices = StandInCollection(co=np.zeros((0, 3)))
+        self.loops = StandInCollection(vertex_index=np.zeros(0, dtype=np.int64))
+        self.polygons = StandInCollection(loop_start=np.zeros(0, dtype=np.int64),
+                                          loop_total=np.zeros(0, dtype=np.int64),
+                                          material_index=np.zeros(0, dtype=np.int64),
+                                          use_smooth=np.zeros(0, dtype=bool),
+                                          select=np.zeros(0, dtype=bool))
+        self.materials = []
+        self.uv_layers = []
+        self.vertex_colors = []
+        self.has_custom_normals = False
+        self.users = 1
+
+    def meshArrays(self):
+        polygons = self.polygons.attributes
+        return adhesion_core.MeshArrays(self.vertices.attributes["co"],
+                                        self.loops.attributes["vertex_index"],
+                                        polygons["loop_start"], polygons["loop_total"],
+                                        polygons["material_index"], polygons["use_smooth"])
+
+    def update(self, calc_edges=False):
+        # Blender derives the polygon normals, areas and centers, and the
+        # vertex normals
+        mesh_arrays = self.meshArrays()
+        normals, areas, centers = mesh_arrays.faceAttributes()
+        self.polygons.attributes.update(normal=normals, area=areas, center=centers)
+        vert_normals = np.zeros((len(mesh_arrays.verts), 3))
+        np.add.at(vert_normals, mesh_arrays.loop_verts,
+                  np.repeat(normals, mesh_arrays.loop_total, axis=0))
+        self.vertices.attributes["normal"] = adhesion_core.normalizeRows(vert_normals)
+
+    def copy(self):
+        mesh = copy.copy(self)
+        mesh.name = self.name + ".001"
+        return mesh
+
+
+IDENTITY = tuple(tuple(row) for row in np.identity(4).tolist())
+
+
+class StandInMatrix(list):
+    def identity(self):
+        self[:] = IDENTITY
+
+
+class StandInObject():
+    # Defaults are shared by the class so that duplicating costs about as
+    # little as with bpy, only what AdhereProc writes is set per object
+    type = 'MESH'
+    select = False
+    parent = None
+    children = ()
+    matrix_world = IDENTITY
+    location = (0.0, 0.0, 0.0)
+    rotation_mode = 'XYZ'
+    rotation_euler = (0.0, 0.0, 0.0)
+    rotation_quaternion = (1.0, 0.0, 0.0, 0.0)
+    delta_location = (0.0, 0.0, 0.0)
+    delta_rotation_euler = (0.0, 0.0, 0.0)
+    scale = (1.0, 1.0, 1.0)
+    material_slots = ()
+
+    def __init__(self, name, data):
+        self.name = name
+        self.data = data
+
+    @property
+    def matrix_parent_inverse(self):
+        # AdhereProc only ever resets it to identity
+        return StandInMatrix(IDENTITY)
+
+    @property
+    def dimensions(self):
+        verts = self.data.vertices.attributes["co"].reshape(-1, 3) * np.asarray(self.scale)
+        if len(verts) == 0:
+            return (0.0, 0.0, 0.0)
+        return tuple(verts.max(axis=0) - verts.min(axis=0))
+
+    def copy(self):
+        new_obj = StandInObject(self.name + ".001", self.data)
+        new_obj.scale = self.scale
+        new_obj.matrix_world = self.matrix_world
+        return new_obj
+
+
+class StandInIDCollection(list):
+    def __init__(self, new):
+        list.__init__(self)
+        self.new_id = new
+
+    def new(self, *args):
+        block = self.new_id(*args)
+        self.append(block)
+        return block
+
+    def get(self, name, default=None):
+        return next((block for block in self if block.name == name), default)
+
+    def remove(self, block, do_unlink=False):
+        if block in self:
+            list.remove(self, block)
+        scene_objects = sys.modules["bpy"].context.scene.objects
+        if block in scene_objects:
+            list.remove(scene_objects, block)
+
+
+class StandInSceneObjects(list):
+    def link(self, obj):
+        self.append(obj)
+
+
+class StandInScene():
+    def __init__(self):
+        self.objects = StandInSceneObjects()
+
+    def update(self):
+        pass
+
+
+def installStandIns():
+    # What AdhereProc needs at import and to adhere meshes in object mode
+    bpy = types.ModuleType("bpy")
+    bpy.context = types.SimpleNamespace(scene=StandInScene())
+    bpy.data = types.SimpleNamespace(meshes=StandInIDCollection(StandInMesh),
+                                     objects=StandInIDCollection(StandInObject))
+    mathutils = types.ModuleType("mathutils")
+    mathutils.Vector = tuple
+    mathutils.Euler = tuple
+    bvhtree = types.ModuleType("mathutils.bvhtree")
+    bvhtree.BVHTree = None
+    mathutils.bvhtree = bvhtree
+    sys.modules["bpy"] = bpy
+    sys.modules["bmesh"] = types.ModuleType("bmesh")
+    sys.modules["mathutils"] = mathutils
+    sys.modules["mathutils.bvhtree"] = bvhtree
+
+
+def loadAdhereObject():
+    try:
+        import bpy
+    except ImportError:
+        installStandIns()
+
+    # Load adhere_object as a submodule without running the add-on __init__
+    package = types.ModuleType(PACKAGE_NAME)
+    package.__path__ = [os.path.dirname(os.path.abspath(__file__))]
+    sys.modules[PACKAGE_NAME] = package
+    spec = importlib.util.spec_from_file_location(PACKAGE_NAME + ".adhere_object",
+                                                  os.path.join(package.__path__[0],
+                                                               "adhere_object.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def makeMeshObject(adhere_object, name, mesh_arrays, select, matrix=None):
+    # Same steps with Blender and with the stand-ins
+    bpy = adhere_object.bpy
+    mesh = adhere_object.AdhereProc().buildMesh(name, mesh_arrays)
+    mesh.update(calc_edges=True)
+    mesh.polygons.foreach_set("select", np.asarray(select, dtype=bool))
+    obj = bpy.data.objects.new(name, mesh)
+    if matrix is not None:
+        obj.matrix_world = np.asarray(matrix).tolist()
+    return obj
+
+
+def removeObjects(bpy, objs):
+    for obj in objs:
+        mesh = obj.data
+        bpy.data.objects.remove(obj, do_unlink=True)
+        if mesh.users == 0:
+            bpy.data.meshes.remove(mesh)
+
+
+def makeGridMesh(face_num):
+    # Wavy grid of quads with about face_num faces
+    size_x = max(int(np.sqrt(face_num)), 1)
+    size_y = max(face_num // size_x, 1)
+    grid_x, grid_y = np.meshgrid(np.arange(size_x + 1, dtype=np.float64),
+                                 np.arange(size_y + 1, dtype=np.float64),
+                                 indexing="ij")
+    grid_z = np.sin(grid_x * 0.3) * np.cos(grid_y * 0.2)
+    verts = np.stack((grid_x, grid_y, grid_z), axis=-1).reshape(-1, 3)
+
+    corner = (np.arange(size_x)[:, np.newaxis] * (size_y + 1) +
+              np.arange(size_y)[np.newaxis, :]).ravel()
+    loop_verts = np.stack((corner, corner + size_y + 1,
+                           corner + size_y + 2, corner + 1), axis=-1).ravel()
+    quad_num = size_x * size_y
+    return adhesion_core.MeshArrays(verts, loop_verts, np.arange(0, quad_num * 4, 4),
+                                    np.full(quad_num, 4))
+
+
+def makeSourceMesh():
+    # Unit cube with the bottom face selected
+    verts = [(x, y, z) for x in (0.0, 1.0) for y in (0.0, 1.0) for z in (0.0, 1.0)]
+    faces = ((0, 2, 6, 4), (1, 5, 7, 3), (0, 1, 3, 2), (4, 6, 7, 5), (0, 4, 5, 1), (2, 3, 7, 6))
+    mesh = adhesion_core.MeshArrays(verts, [i for face in faces for i in face],
+                                    np.arange(0, 24, 4), np.full(6, 4))
+    select = np.zeros(6, dtype=bool)
+    select[0] = True
+    return mesh, select
+
+
+class PhaseTimer():
+    # Wall time of each phase, or with trace_memory set its peak traced
+    # memory instead. Tracing slows Python heavy phases far more than NumPy
+    # ones, so time and memory are never measured in the same pass.
+    def __init__(self):
+        self.records = {}
+        self.trace_memory = False
+
+    def run(self, name, face_num, func, *args):
+        record = self.records.setdefault(name, {"seconds": [], "peak_bytes": 0})
+        record["faces"] = face_num
+        if self.trace_memory:
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+            mem_start = tracemalloc.get_traced_memory()[0]
+            result = func(*args)
+            mem_peak = tracemalloc.get_traced_memory()[1] - mem_start
+            record["peak_bytes"] = max(record["peak_bytes"], mem_peak)
+            return result
+
+        time_start = time.perf_counter()
+        result = func(*args)
+        record["seconds"].append(time.perf_counter() - time_start)
+        return result
+
+    def summary(self):
+        phases = {}
+        for name, record in self.records.items():
+            best = min(record["seconds"])
+            phases[name] = {"seconds": best,
+                            "faces_per_second": record["faces"] / best if best > 0.0 else None,
+                            "peak_bytes": record["peak_bytes"]}
+        return phases
+
+
+def runPhases(adhere_object, timer, target_obj, source_obj, transform, sel_num, max_copies):
+    bpy = adhere_object.bpy
+    offset = (0.0, 0.0, 0.1)
+
+    # The foreach_get snapshot AdhereProc reads the selection with
+    faces = timer.run("selection", len(target_obj.data.polygons),
+                      adhere_object.SelectionSnapshot, target_obj.data)
+    normals = timer.run("normal", sel_num,
+                        lambda: transform.applyToNormals(faces.faceNormals()))
+    centers = timer.run("center", sel_num,
+                        lambda: transform.applyToPoints(faces.centers))
+
+    # Center Of Selected Faces from both selections to the moved source,
+    # with the source read again as on its first execution
+    adhere_object.caches.source_cache.clear()
+    timer.run("single", sel_num, adhere_object.AdhereProc().execSingleAdhesion,
+              target_obj, source_obj, offset)
+
+    if sel_num > max_copies:
+        return
+    source_snapshot = adhere_object.SelectionSnapshot(source_obj.data)
+    placements = adhesion_core.solvePlacements(source_snapshot.averageNormal(),
+                                               source_snapshot.centerPoint(),
+                                               source_obj.scale, normals, centers, offset)
+    proc = adhere_object.AdhereProc()
+    dup_objs = timer.run("duplication", sel_num,
+                         proc.getDuplicateObjList, source_obj, sel_num, False)
+    timer.run("transform", sel_num, proc.applyPlacements, dup_objs, placements)
+    removeObjects(bpy, dup_objs)
+
+
+def runCase(adhere_object, face_num, density, repeat, max_copies, seed):
+    target = makeGridMesh(face_num)
+    source, source_select = makeSourceMesh()
+    select = np.random.RandomState(seed).random_sample(target.faceCount()) < density
+    if not select.any():
+        select[0] = True
+    sel_num = int(select.sum())
+
+    transform = adhesion_core.Transform.fromEuler((1.0, 2.0, 3.0), (0.1, 0.2, 0.3), (1.0, 1.0, 1.0))
+    target_obj = makeMeshObject(adhere_object, "Target", target, select, transform.matrix)
+    source_obj = makeMeshObject(adhere_object, "Source", source, source_select)
+    timer = PhaseTimer()
+
+    for i in range(0, repeat):
+        runPhases(adhere_object, timer, target_obj, source_obj, transform, sel_num, max_copies)
+
+    # One more pass for the memory of each phase
+    timer.trace_memory = True
+    tracemalloc.start()
+    runPhases(adhere_object, timer, target_obj, source_obj, transform, sel_num, max_copies)
+    tracemalloc.stop()
+    removeObjects(adhere_object.bpy, [target_obj, source_obj])
+
+    return {"faces": target.faceCount(),
+            "density": density,
+            "selected": sel_num,
+            "phases": timer.summary()}
+
+
+def compareBaseline(report, baseline, tolerance):
+    regressions = []
+    base_cases = {(case["faces"], case["density"]): case for case in baseline["cases"]}
+    for case in report["cases"]:
+        base_case = base_cases.get((case["faces"], case["density"]))
+        if base_case is None:
+            continue
+        for name, phase in case["phases"].items():
+            base_phase = base_case["phases"].get(name)
+            if base_phase is None or base_phase["seconds"] <= 0.0:
+                continue
+            ratio = phase["seconds"] / base_phase["seconds"]
+            phase["baseline_ratio"] = ratio
+            if ratio > 1.0 + tolerance:
+                regressions.append((case["faces"], case["density"], name, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the mesh adhesion pipeline")
+    parser.add_argument("--faces", type=int, nargs="+", default=DEFAULT_FACES)
+    parser.add_argument("--density", type=float, nargs="+", default=DEFAULT_DENSITY)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max-copies", type=int, default=100000,
+                        help="skip duplication and transform above this many copies")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--baseline", help="compare against a stored JSON report")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed slowdown against the baseline, 0.2 = 20%%")
+    args = parser.parse_args(argv)
+
+    adhere_object = loadAdhereObject()
+    report = {"python": platform.python_version(),
+              "numpy": np.__version__,
+              "machine": platform.machine(),
+              "cases": []}
+    for face_num in args.faces:
+        for density in args.density:
+            case = runCase(adhere_object, face_num, density, args.repeat,
+                           args.max_copies, args.seed)
+            report["cases"].append(case)
+            print("faces %9d  density %6.3f  selected %9d  %s" % (
+                case["faces"], density, case["selected"],
+                "  ".join("%s %.4fs" % (name, case["phases"][name]["seconds"])
+                          for name in PHASES if name in case["phases"])))
+
+    ret = 0
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compareBaseline(report, json.load(baseline_file), args.tolerance)
+        for face_num, density, name, ratio in regressions:
+            print("regression: faces %d density %.3f %s %.2fx slower" % (
+                face_num, density, name, ratio))
+        if regressions:
+            ret = 1
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+    return ret
+
+
+if __name__ == "__main__":
+    sys.exit(main())
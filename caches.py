@@ -0,0 +1,221 @@
+############################################################################
+#
+# caches.py
+#
+# Copyright (C) 2018 chaosdesk
+#
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.#
+#
+# ##### END GPL LICENSE BLOCK #####
+#
+############################################################################
+
+import bpy
+import bmesh
+import numpy as np
+from collections import OrderedDict
+from mathutils import Vector
+from mathutils.bvhtree import BVHTree
+
+
+def meshFingerprint(obj):
+    mesh = obj.data
+    if mesh.is_editmode:
+        bm = bmesh.from_edit_mesh(mesh)
+        return (mesh.name, True, len(bm.verts), len(bm.faces))
+    return (mesh.name, False, len(mesh.vertices), len(mesh.polygons))
+
+
+def meshContentKey(mesh):
+    # Hash of which faces are selected and where the vertices are. Only
+    # used for adhered meshes, which are small enough to read every time.
+    if mesh.is_editmode:
+        bm = bmesh.from_edit_mesh(mesh)
+        select = np.array([face.select for face in bm.faces], dtype=bool)
+        coords = np.array([vert.co for vert in bm.verts], dtype=np.float32)
+    else:
+        select = np.zeros(len(mesh.polygons), dtype=bool)
+        coords = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+        mesh.polygons.foreach_get("select", select)
+        mesh.vertices.foreach_get("co", coords)
+    return hash((select.tobytes(), coords.tobytes()))
+
+
+class BVHCache():
+    # Least recently used BVH trees of meshes in their local space, kept
+    # until the mesh changes. Picking builds trees of every mesh a ray
+    # enters, so only the latest size trees are kept.
+    def __init__(self, size=16):
+        self.size = size
+        self.entries = OrderedDict()
+
+    def get(self, obj):
+        fingerprint = meshFingerprint(obj)
+        entry = self.entries.get(obj.name)
+        if entry is not None and entry[0] == fingerprint:
+            self.entries.move_to_end(obj.name)
+            return entry[1]
+
+        mesh = obj.data
+        if mesh.is_editmode:
+            tree = BVHTree.FromBMesh(bmesh.from_edit_mesh(mesh))
+        else:
+            bm = bmesh.new()
+            bm.from_mesh(mesh)
+            tree = BVHTree.FromBMesh(bm)
+            bm.free()
+        self.entries[obj.name] = (fingerprint, tree)
+        self.entries.move_to_end(obj.name)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+        return tree
+
+    def invalidateUpdated(self):
+        # Only the cached objects are checked, not every object in the scene
+        for name in list(self.entries.keys()):
+            obj = bpy.data.objects.get(name)
+            if obj is None or obj.is_updated_data:
+                del self.entries[name]
+
+    def clear(self):
+        self.entries.clear()
+
+
+class SourceCache():
+    # Least recently used descriptors of adhered meshes by mesh name. The
+    # fingerprint catches changed counts, selection and vertex positions in
+    # and out of edit mode, invalidateUpdated drops entries early.
+    def __init__(self, size=8):
+        self.size = size
+        self.entries = OrderedDict()
+
+    def get(self, obj, build):
+        fingerprint = meshFingerprint(obj) + (meshContentKey(obj.data),)
+        entry = self.entries.get(obj.data.name)
+        if entry is not None and entry[0] == fingerprint:
+            self.entries.move_to_end(obj.data.name)
+            return entry[1]
+
+        descriptor = build(obj)
+        self.entries[obj.data.name] = (fingerprint, descriptor)
+        self.entries.move_to_end(obj.data.name)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+        return descriptor
+
+    def invalidateUpdated(self):
+        for name in list(self.entries.keys()):
+            mesh = bpy.data.meshes.get(name)
+            if mesh is None or mesh.is_updated or mesh.is_updated_data:
+                del self.entries[name]
+
+    def clear(self):
+        self.entries.clear()
+
+
+class SceneRayIndex():
+    # World bounding boxes of the visible mesh objects for picking by ray.
+    # Boxes are only recomputed for objects whose matrix changed.
+    def __init__(self):
+        self.boxes = {}
+        self.names = []
+        self.box_min = np.zeros((0, 3))
+        self.box_max = np.zeros((0, 3))
+        self.scene_name = None
+        self.dirty = True
+
+    def refresh(self, scene):
+        if not self.dirty and scene.name == self.scene_name:
+            return
+        self.dirty = False
+        self.scene_name = scene.name
+
+        boxes = {}
+        for obj in scene.objects:
+            if obj.type != 'MESH' or not obj.is_visible(scene):
+                continue
+            matrix_key = tuple(value for row in obj.matrix_world for value in row)
+            box = self.boxes.get(obj.name)
+            if box is None or box[0] != matrix_key:
+                matrix = np.array(matrix_key).reshape(4, 4)
+                corners = np.array(obj.bound_box).dot(matrix[:3, :3].T) + matrix[:3, 3]
+                box = (matrix_key, corners.min(axis=0), corners.max(axis=0))
+            boxes[obj.name] = box
+        self.boxes = boxes
+
+        self.names = list(boxes.keys())
+        if len(self.names) > 0:
+            self.box_min = np.array([boxes[name][1] for name in self.names])
+            self.box_max = np.array([boxes[name][2] for name in self.names])
+        else:
+            self.box_min = np.zeros((0, 3))
+            self.box_max = np.zeros((0, 3))
+
+    def pick(self, scene, origin, direction):
+        self.refresh(scene)
+        origin = np.asarray(origin, dtype=np.float64)
+        direction = np.asarray(direction, dtype=np.float64)
+
+        # Slab test of the ray against every box at once
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inv_dir = 1.0 / direction
+            dist_a = (self.box_min - origin) * inv_dir
+            dist_b = (self.box_max - origin) * inv_dir
+        dist_a = np.nan_to_num(dist_a)
+        dist_b = np.nan_to_num(dist_b)
+        dist_enter = np.maximum(np.minimum(dist_a, dist_b).max(axis=1), 0.0)
+        dist_exit = np.maximum(dist_a, dist_b).min(axis=1)
+        candidates = np.flatnonzero(dist_exit >= dist_enter)
+        candidates = candidates[np.argsort(dist_enter[candidates])]
+
+        # Refine with the mesh BVH of the boxes the ray enters, nearest first
+        picked_obj = None
+        picked_dist = np.inf
+        for index in candidates:
+            if dist_enter[index] > picked_dist:
+                break
+            obj = scene.objects.get(self.names[index])
+            if obj is None:
+                continue
+            matrix = np.array(obj.matrix_world)
+            inv_matrix = np.linalg.inv(matrix)
+            local_origin = inv_matrix[:3, :3].dot(origin) + inv_matrix[:3, 3]
+            local_direction = inv_matrix[:3, :3].dot(direction)
+            location, normal, face_index, dist = bvh_cache.get(obj).ray_cast(
+                Vector(local_origin), Vector(local_direction))
+            if location is None:
+                continue
+            world_dist = np.linalg.norm(matrix[:3, :3].dot(location) + matrix[:3, 3] - origin)
+            if world_dist < picked_dist:
+                picked_obj = obj
+                picked_dist = world_dist
+
+        return picked_obj
+
+
+bvh_cache = BVHCache()
+source_cache = SourceCache()
+scene_ray_index = SceneRayIndex()
+
+
+def sceneUpdate():
+    bvh_cache.invalidateUpdated()
+    source_cache.invalidateUpdated()
+    if bpy.data.objects.is_updated:
+        scene_ray_index.dirty = True
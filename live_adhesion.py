@@ -0,0 +1,172 @@
+############################################################################
+#
+# live_adhesion.py
+#
+# Copyright (C) 2018 chaosdesk
+#
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.#
+#
+# ##### END GPL LICENSE BLOCK #####
+#
+############################################################################
+
+import time
+import bpy
+import numpy as np
+from . import adhesion_core
+from . import adhere_object
+
+
+# Seconds the target has to stay unchanged before copies follow it
+DEBOUNCE_SECONDS = 0.25
+
+
+def matrixKey(obj):
+    return tuple(value for row in obj.matrix_world for value in row)
+
+
+class LiveLink():
+    # Copies adhered to faces of a target, kept on those faces while the
+    # target is edited. Each face is fingerprinted by its local center and
+    # normal, and only copies of faces whose fingerprint changed are moved.
+    def __init__(self, org_obj, adh_obj, aobj, faces, offset):
+        adh_snapshot = aobj.getSnapshot(adh_obj)
+        self.org_name = org_obj.name
+        self.faces = np.asarray(faces, dtype=np.int64)
+        self.copy_names = [obj.name for obj in aobj.copy_objs]
+        self.src_normal = adh_snapshot.averageNormal()
+        self.src_center = adh_snapshot.centerPoint()
+        self.src_scale = tuple(adh_obj.scale)
+        self.offset = tuple(offset)
+        # Set when readFaces synced the edit mesh into the polygons
+        self.synced = False
+        self.fingerprint = self.readFaces(org_obj)
+        self.matrix_key = matrixKey(org_obj)
+        self.changed_time = None
+
+    def readFaces(self, org_obj):
+        # (N,6) local centers and normals of the linked faces, NaN for
+        # faces that no longer exist
+        mesh = org_obj.data
+        fingerprint = np.full((len(self.faces), 6), np.nan, dtype=np.float32)
+        self.synced = mesh.is_editmode and adhere_object.AdhereProc().syncEditMesh(org_obj)
+        if mesh.is_editmode and not self.synced:
+            # Only the linked faces are read from the edit mesh
+            bm = adhere_object.AdhereProc.getBMesh(mesh)
+            bm.faces.ensure_lookup_table()
+            face_num = len(bm.faces)
+            for i, index in enumerate(self.faces.tolist()):
+                if index < face_num:
+                    face = bm.faces[index]
+                    fingerprint[i, :3] = face.calc_center_median()
+                    fingerprint[i, 3:] = face.normal
+            return fingerprint
+
+        # Polygons are current outside edit mode or after the sync, so all
+        # of them are read in bulk
+        face_num = len(mesh.polygons)
+        centers = np.empty(face_num * 3, dtype=np.float32)
+        normals = np.empty(face_num * 3, dtype=np.float32)
+        mesh.polygons.foreach_get("center", centers)
+        mesh.polygons.foreach_get("normal", normals)
+        valid = self.faces < face_num
+        fingerprint[valid, :3] = centers.reshape(-1, 3)[self.faces[valid]]
+        fingerprint[valid, 3:] = normals.reshape(-1, 3)[self.faces[valid]]
+        return fingerprint
+
+    def update(self, org_obj):
+        fingerprint = self.readFaces(org_obj)
+        matrix_key = matrixKey(org_obj)
+        if matrix_key != self.matrix_key:
+            # The whole target moved, so every copy moves with it
+            changed = np.ones(len(self.faces), dtype=bool)
+        else:
+            changed = np.any(fingerprint != self.fingerprint, axis=1)
+        changed &= ~np.isnan(fingerprint[:, 0])
+        self.fingerprint = fingerprint
+        self.matrix_key = matrix_key
+
+        changed_index = np.flatnonzero(changed)
+        if len(changed_index) == 0:
+            return 0
+
+        copy_objs = [bpy.data.objects.get(self.copy_names[i]) for i in changed_index.tolist()]
+        exists = np.array([obj is not None for obj in copy_objs], dtype=bool)
+        changed_index = changed_index[exists]
+        copy_objs = [obj for obj in copy_objs if obj is not None]
+        if len(copy_objs) == 0:
+            return 0
+
+        transform = adhere_object.getTransform(org_obj)
+        placements = adhesion_core.solvePlacements(
+            self.src_normal, self.src_center, self.src_scale,
+            transform.applyToNormals(fingerprint[changed_index, 3:]),
+            transform.applyToPoints(fingerprint[changed_index, :3]), self.offset)
+        adhere_object.AdhereProc().applyPlacements(copy_objs, placements)
+
+        return len(copy_objs)
+
+
+live_links = []
+
+
+def addLink(org_obj, adh_obj, aobj, offset):
+    # Only copies placed one per target face can follow the faces, which
+    # needs the placement log of the run
+    if not aobj.placement_log or \
+       any(placements.faces is None for name, placements in aobj.placement_log):
+        return None
+    faces = np.concatenate([placements.faces for name, placements in aobj.placement_log])
+    if len(faces) != len(aobj.copy_objs):
+        return None
+
+    # Links follow the normals only, not tangent frames
+    if aobj.orient_option != "NORMAL":
+        return None
+
+    link = LiveLink(org_obj, adh_obj, aobj, faces, offset)
+    live_links.append(link)
+    return link
+
+
+def sceneUpdate():
+    if len(live_links) == 0:
+        return
+
+    # Only the flags of each target are checked here, the copies are only
+    # looked up for faces that changed
+    now = time.time()
+    for link in list(live_links):
+        org_obj = bpy.data.objects.get(link.org_name)
+        if org_obj is None:
+            live_links.remove(link)
+            continue
+
+        # Wait until the edits settle before moving any copy. The update
+        # written by the edit mode sync of the link itself is skipped once.
+        if org_obj.is_updated or org_obj.is_updated_data:
+            if link.synced:
+                link.synced = False
+            else:
+                link.changed_time = now
+        elif link.changed_time is not None and now - link.changed_time >= DEBOUNCE_SECONDS:
+            link.changed_time = None
+            link.update(org_obj)
+
+
+def clear():
+    del live_links[:]
@@ -0,0 +1,341 @@
+############################################################################
+#
+# mesh_io.py
+#
+# Copyright (C) 2018 chaosdesk
+#
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.#
+#
+# ##### END GPL LICENSE BLOCK #####
+#
+############################################################################
+
+# Streaming OBJ and PLY reading and writing on adhesion_core.MeshArrays.
+# Files are parsed line by line or block by block into compact arrays, and
+# adhered copies are written one tile at a time, so neither the input text
+# nor the whole output mesh is ever held in memory.
+
+import os
+import struct
+from array import array
+
+import numpy as np
+
+try:
+    from . import adhesion_core
+except ImportError:
+    import adhesion_core
+
+
+PLY_TYPES = {"char": "i1", "int8": "i1", "uchar": "u1", "uint8": "u1",
+             "short": "i2", "int16": "i2", "ushort": "u2", "uint16": "u2",
+             "int": "i4", "int32": "i4", "uint": "u4", "uint32": "u4",
+             "float": "f4", "float32": "f4", "double": "f8", "float64": "f8"}
+
+
+class MeshFile():
+    # Mesh read from a file with the material and group name of each face
+    def __init__(self, mesh_arrays, face_material=None, material_names=None,
+                 face_group=None, group_names=None):
+        self.mesh_arrays = mesh_arrays
+        self.face_material = face_material
+        self.material_names = material_names or []
+        self.face_group = face_group
+        self.group_names = group_names or []
+
+    def selectByMaterial(self, name):
+        if self.face_material is None or name not in self.material_names:
+            raise ValueError("material '%s' not found" % name)
+        return self.face_material == self.material_names.index(name)
+
+    def selectByGroup(self, name):
+        if self.face_group is None or name not in self.group_names:
+            raise ValueError("group '%s' not found" % name)
+        return self.face_group == self.group_names.index(name)
+
+
+def readMesh(filepath):
+    ext = os.path.splitext(filepath)[1].lower()
+    if ext == ".obj":
+        return readObj(filepath)
+    elif ext == ".ply":
+        return readPly(filepath)
+    raise ValueError("unsupported mesh format: %s" % filepath)
+
+
+def readObj(filepath):
+    verts = array("d")
+    loop_verts = array("l")
+    loop_total = array("l")
+    face_material = array("l")
+    face_group = array("l")
+    material_names = []
+    group_names = []
+    material = -1
+    group = -1
+
+    with open(filepath, "r") as obj_file:
+        for line in obj_file:
+            if line.startswith("v "):
+                verts.extend(float(val) for val in line.split()[1:4])
+            elif line.startswith("f "):
+                vert_num = len(verts) // 3
+                tokens = line.split()[1:]
+                for token in tokens:
+                    index = int(token.split("/", 1)[0])
+                    loop_verts.append(index - 1 if index > 0 else vert_num + index)
+                loop_total.append(len(tokens))
+                face_material.append(material)
+                face_group.append(group)
+            elif line.startswith("usemtl "):
+                name = line[7:].strip()
+                if name not in material_names:
+                    material_names.append(name)
+                material = material_names.index(name)
+            elif line.startswith("g ") or line.startswith("o "):
+                name = line[2:].strip()
+                if name not in group_names:
+                    group_names.append(name)
+                group = group_names.index(name)
+
+    loop_total = np.frombuffer(loop_total, dtype=np.dtype("l")).astype(np.int64)
+    loop_start = np.zeros(len(loop_total), dtype=np.int64)
+    np.cumsum(loop_total[:-1], out=loop_start[1:])
+    mesh_arrays = adhesion_core.MeshArrays(np.frombuffer(verts, dtype=np.float64),
+                                           np.frombuffer(loop_verts, dtype=np.dtype("l")),
+                                           loop_start, loop_total)
+
+    return MeshFile(mesh_arrays,
+                    np.frombuffer(face_material, dtype=np.dtype("l")), material_names,
+                    np.frombuffer(face_group, dtype=np.dtype("l")), group_names)
+
+
+def readPlyHeader(ply_file):
+    if ply_file.readline().strip() != b"ply":
+        raise ValueError("not a PLY file")
+
+    ply_format = None
+    elements = []
+    while True:
+        line = ply_file.readline()
+        if not line:
+            raise ValueError("unterminated PLY header")
+        words = line.decode("ascii").split()
+        if not words or words[0] in ("comment", "obj_info"):
+            continue
+        if words[0] == "format":
+            ply_format = words[1]
+        elif words[0] == "element":
+            elements.append((words[1], int(words[2]), []))
+        elif words[0] == "property":
+            if words[1] == "list":
+                elements[-1][2].append((words[4], PLY_TYPES[words[2]], PLY_TYPES[words[3]]))
+            else:
+                elements[-1][2].append((words[2], PLY_TYPES[words[1]], None))
+        elif words[0] == "end_header":
+            break
+
+    return ply_format, elements
+
+
+def readPly(filepath):
+    with open(filepath, "rb") as ply_file:
+        ply_format, elements = readPlyHeader(ply_file)
+        if ply_format == "ascii":
+            read_element = readPlyElementAscii
+        elif ply_format in ("binary_little_endian", "binary_big_endian"):
+            read_element = readPlyElementBinary
+        else:
+            raise ValueError("unsupported PLY format: %s" % ply_format)
+        byte_order = "<" if ply_format == "binary_little_endian" else ">"
+
+        verts = None
+        loop_verts = None
+        loop_total = None
+        for name, count, props in elements:
+            data = read_element(ply_file, count, props, byte_order)
+            if name == "vertex":
+                verts = np.stack((data["x"], data["y"], data["z"]), axis=-1)
+            elif name == "face":
+                list_name = [prop[0] for prop in props if prop[2] is not None][0]
+                loop_total, loop_verts = data[list_name]
+
+    if verts is None or loop_verts is None:
+        raise ValueError("PLY file has no vertex or face element")
+    loop_start = np.zeros(len(loop_total), dtype=np.int64)
+    np.cumsum(loop_total[:-1], out=loop_start[1:])
+
+    return MeshFile(adhesion_core.MeshArrays(verts, loop_verts, loop_start, loop_total))
+
+
+def readPlyElementAscii(ply_file, count, props, byte_order):
+    scalars = {prop[0]: array("d") for prop in props if prop[2] is None}
+    lists = {prop[0]: (array("l"), array("l")) for prop in props if prop[2] is not None}
+
+    for i in range(0, count):
+        words = ply_file.readline().split()
+        pos = 0
+        for name, count_type, item_type in props:
+            if item_type is None:
+                scalars[name].append(float(words[pos]))
+                pos += 1
+            else:
+                item_num = int(words[pos])
+                lists[name][0].append(item_num)
+                lists[name][1].extend(int(word) for word in words[pos + 1:pos + 1 + item_num])
+                pos += 1 + item_num
+
+    data = {name: np.frombuffer(values, dtype=np.float64) for name, values in scalars.items()}
+    for name, (totals, items) in lists.items():
+        data[name] = (np.frombuffer(totals, dtype=np.dtype("l")),
+                      np.frombuffer(items, dtype=np.dtype("l")))
+    return data
+
+
+def readPlyElementBinary(ply_file, count, props, byte_order):
+    list_props = [prop for prop in props if prop[2] is not None]
+    if not list_props:
+        # Fixed size rows are read as one block
+        dtype = np.dtype([(name, byte_order + prop_type) for name, prop_type, _ in props])
+        return np.fromfile(ply_file, dtype=dtype, count=count)
+    if len(props) != 1:
+        raise ValueError("only a single list property per element is supported")
+
+    name, count_type, item_type = list_props[0]
+    count_dtype = np.dtype(byte_order + count_type)
+    item_dtype = np.dtype(byte_order + item_type)
+    if count == 0:
+        return {name: (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))}
+
+    # Most files have the same item count in every row, which is read as
+    # one block. Otherwise fall back to reading row by row.
+    start = ply_file.tell()
+    item_num = int(np.fromfile(ply_file, dtype=count_dtype, count=1)[0])
+    ply_file.seek(start)
+    row_dtype = np.dtype([("count", count_dtype), ("items", item_dtype, (item_num,))])
+    rows = np.fromfile(ply_file, dtype=row_dtype, count=count)
+    if len(rows) == count and (rows["count"] == item_num).all():
+        return {name: (rows["count"].astype(np.int64),
+                       rows["items"].astype(np.int64).ravel())}
+
+    ply_file.seek(start)
+    totals = array("l")
+    items = array("l")
+    count_size = count_dtype.itemsize
+    count_format = byte_order + count_dtype.char
+    for i in range(0, count):
+        item_num = struct.unpack(count_format, ply_file.read(count_size))[0]
+        totals.append(item_num)
+        items.extend(np.fromfile(ply_file, dtype=item_dtype, count=item_num).tolist())
+    return {name: (np.frombuffer(totals, dtype=np.dtype("l")),
+                   np.frombuffer(items, dtype=np.dtype("l")))}
+
+
+def writeTiles(filepath, src_mesh, placements, scale, base_mesh=None):
+    ext = os.path.splitext(filepath)[1].lower()
+    if ext == ".obj":
+        writeObjTiles(filepath, src_mesh, placements, scale, base_mesh)
+    elif ext == ".ply":
+        writePlyTiles(filepath, src_mesh, placements, scale, base_mesh)
+    else:
+        raise ValueError("unsupported mesh format: %s" % filepath)
+
+
+def iterTiles(src_mesh, placements, scale):
+    # World vertices of one copy at a time, placements may also be an
+    # adhesion_core.PlacementStream
+    verts = src_mesh.verts * np.asarray(scale)
+    chunks = (placements,)
+    if isinstance(placements, adhesion_core.PlacementStream):
+        chunks = placements.chunks()
+    for chunk in chunks:
+        mats_rot = adhesion_core.quaternionToMatrix(chunk.quats)
+        locations = chunk.worldLocations()
+        for mat_rot, location in zip(mats_rot, locations):
+            yield verts.dot(mat_rot.T) + location
+
+
+def writeObjFaces(obj_file, mesh_arrays, vert_base):
+    for start, total in zip(mesh_arrays.loop_start, mesh_arrays.loop_total):
+        obj_file.write("f " + " ".join(str(index + vert_base) for index in
+                                       mesh_arrays.loop_verts[start:start + total]) + "\n")
+
+
+def writeObjTiles(filepath, src_mesh, placements, scale, base_mesh=None):
+    with open(filepath, "w") as obj_file:
+        if base_mesh is not None:
+            np.savetxt(obj_file, base_mesh.verts, fmt="v %.6f %.6f %.6f")
+            writeObjFaces(obj_file, base_mesh, 1)
+
+        # Faces index relative to the last vertex, so every tile shares them
+        vert_num = len(src_mesh.verts)
+        tile_faces = []
+        for start, total in zip(src_mesh.loop_start, src_mesh.loop_total):
+            tile_faces.append("f " + " ".join(str(index - vert_num) for index in
+                                              src_mesh.loop_verts[start:start + total]))
+        tile_faces = "\n".join(tile_faces) + "\n"
+
+        for tile_verts in iterTiles(src_mesh, placements, scale):
+            np.savetxt(obj_file, tile_verts, fmt="v %.6f %.6f %.6f")
+            obj_file.write(tile_faces)
+
+
+def plyFaceBytes(mesh_arrays):
+    # Face rows as uchar count followed by int32 indices, and the byte
+    # positions of the indices so that they can be rewritten per tile
+    face_num = mesh_arrays.faceCount()
+    loop_num = len(mesh_arrays.loop_verts)
+    face_bytes = np.zeros(face_num + loop_num * 4, dtype=np.uint8)
+    count_pos = np.arange(face_num) + mesh_arrays.loop_start * 4
+    face_bytes[count_pos] = mesh_arrays.loop_total
+    loop_face = np.repeat(np.arange(face_num), mesh_arrays.loop_total)
+    loop_pos = np.arange(loop_num) * 4 + loop_face + 1
+    index_pos = (loop_pos[:, np.newaxis] + np.arange(4)).ravel()
+    return face_bytes, index_pos
+
+
+def writePlyTiles(filepath, src_mesh, placements, scale, base_mesh=None):
+    vert_num = len(src_mesh.verts) * placements.count()
+    face_num = src_mesh.faceCount() * placements.count()
+    if base_mesh is not None:
+        vert_num += len(base_mesh.verts)
+        face_num += base_mesh.faceCount()
+
+    with open(filepath, "wb") as ply_file:
+        header = ("ply\nformat binary_little_endian 1.0\n"
+                  "element vertex %d\nproperty float x\nproperty float y\nproperty float z\n"
+                  "element face %d\nproperty list uchar int vertex_indices\nend_header\n"
+                  % (vert_num, face_num))
+        ply_file.write(header.encode("ascii"))
+
+        if base_mesh is not None:
+            ply_file.write(base_mesh.verts.astype("<f4").tobytes())
+        for tile_verts in iterTiles(src_mesh, placements, scale):
+            ply_file.write(tile_verts.astype("<f4").tobytes())
+
+        vert_base = 0
+        if base_mesh is not None:
+            face_bytes, index_pos = plyFaceBytes(base_mesh)
+            face_bytes[index_pos] = base_mesh.loop_verts.astype("<i4").view(np.uint8)
+            ply_file.write(face_bytes.tobytes())
+            vert_base = len(base_mesh.verts)
+
+        face_bytes, index_pos = plyFaceBytes(src_mesh)
+        for i in range(0, placements.count()):
+            tile_loop_verts = src_mesh.loop_verts + vert_base + i * len(src_mesh.verts)
+            face_bytes[index_pos] = tile_loop_verts.astype("<i4").view(np.uint8)
+            ply_file.write(face_bytes.tobytes())
@@ -0,0 +1,123 @@
+############################################################################
+#
+# placement_io.py
+#
+# Copyright (C) 2018 chaosdesk
+#
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.#
+#
+# ##### END GPL LICENSE BLOCK #####
+#
+############################################################################
+
+# Placements as a compact binary file, readable with numpy.memmap.
+#
+#   header   32 bytes: magic b"MADHPLC\0", uint32 version, uint32 record
+#            size, uint64 record count, uint32 names size, uint32 reserved
+#   names    UTF-8 JSON list of source names, padded to 4 bytes
+#   records  little endian float32 source id, location xyz, rotation
+#            quaternion wxyz and rotated offset xyz, 44 bytes each
+#
+# Locations are world origins of the copies without their offsets, as
+# written to location and delta_location.
+
+import json
+import struct
+
+import numpy as np
+
+try:
+    from . import adhesion_core
+except ImportError:
+    import adhesion_core
+
+
+MAGIC = b"MADHPLC\0"
+VERSION = 1
+HEADER_FORMAT = "<8sIIQII"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+RECORD_DTYPE = np.dtype([("source", "<f4"),
+                         ("location", "<f4", (3,)),
+                         ("rotation", "<f4", (4,)),
+                         ("offset", "<f4", (3,))])
+
+
+class PlacementFile():
+    # Records of a placement file mapped into memory, not read up front
+    def __init__(self, filepath):
+        with open(filepath, "rb") as placement_file:
+            header = placement_file.read(HEADER_SIZE)
+            if len(header) < HEADER_SIZE:
+                raise ValueError("%s: not a placement file" % filepath)
+            magic, version, record_size, count, names_size, reserved = \
+                struct.unpack(HEADER_FORMAT, header)
+            if magic != MAGIC:
+                raise ValueError("%s: not a placement file" % filepath)
+            if version > VERSION or record_size != RECORD_DTYPE.itemsize:
+                raise ValueError("%s: unsupported placement file version %d" % (filepath,
+                                                                                version))
+            self.source_names = json.loads(placement_file.read(names_size).decode("utf-8"))
+
+        self.records = np.zeros(0, dtype=RECORD_DTYPE)
+        if count > 0:
+            self.records = np.memmap(filepath, dtype=RECORD_DTYPE, mode="r",
+                                     offset=HEADER_SIZE + names_size, shape=(count,))
+
+    def count(self):
+        return len(self.records)
+
+    def sourceIds(self):
+        return self.records["source"].astype(np.int64)
+
+    def placements(self, source_id=None):
+        # Placements of one source, or of all records
+        records = self.records
+        if source_id is not None:
+            records = records[self.sourceIds() == source_id]
+        offsets = records["offset"].astype(np.float64)
+        if not offsets.any():
+            offsets = None
+        return adhesion_core.Placements(records["rotation"].astype(np.float64),
+                                        records["location"].astype(np.float64), offsets)
+
+
+def writePlacements(filepath, placements_list):
+    # placements_list holds (source name, Placements) pairs
+    source_names = []
+    for name, placements in placements_list:
+        if name not in source_names:
+            source_names.append(name)
+    names = json.dumps(source_names).encode("utf-8")
+    names += b" " * (-len(names) % 4)
+    count = sum(placements.count() for name, placements in placements_list)
+
+    with open(filepath, "wb") as placement_file:
+        placement_file.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, RECORD_DTYPE.itemsize,
+                                         count, len(names), 0))
+        placement_file.write(names)
+        for name, placements in placements_list:
+            records = np.zeros(placements.count(), dtype=RECORD_DTYPE)
+            records["source"] = source_names.index(name)
+            records["location"] = placements.locations
+            records["rotation"] = placements.quats
+            if placements.offsets is not None:
+                records["offset"] = placements.offsets
+            placement_file.write(records.tobytes())
+
+
+def readPlacements(filepath):
+    return PlacementFile(filepath)
@@ -0,0 +1,162 @@
+############################################################################
+#
+# profiling.py
+#
+# Copyright (C) 2018 chaosdesk
+#
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.#
+#
+# ##### END GPL LICENSE BLOCK #####
+#
+############################################################################
+
+# Per phase timing of an adhesion run.
+#
+# AdhereProc wraps each phase in "with self.profiler.phase(name, face_num)".
+# The default NULL_PROFILER hands out one shared no-op context, so a
+# disabled run only pays for that call per phase, never per face.
+
+import json
+import sys
+import time
+from collections import OrderedDict
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def resetPeakRss():
+    # Linux restarts the peak resident set size of the process on request
+    try:
+        with open("/proc/self/clear_refs", "w") as refs_file:
+            refs_file.write("5")
+        return True
+    except (IOError, OSError):
+        return False
+
+
+def peakRss():
+    # Peak resident set size in bytes since start or resetPeakRss, None if
+    # the platform doesn't tell
+    try:
+        with open("/proc/self/status") as status_file:
+            for line in status_file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak
+    return peak * 1024
+
+
+def formatBytes(size):
+    if size is None:
+        return "unknown"
+    return "%.1f MiB" % (size / 1048576.0)
+
+
+class NullPhase():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class NullProfiler():
+    enabled = False
+
+    def __init__(self):
+        self.null_phase = NullPhase()
+
+    def phase(self, name, face_num=0):
+        return self.null_phase
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class PhaseTimer():
+    def __init__(self, profiler, name, face_num):
+        self.profiler = profiler
+        self.name = name
+        self.face_num = face_num
+        self.time_start = 0.0
+
+    def __enter__(self):
+        self.time_start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.addRecord(self.name, time.perf_counter() - self.time_start,
+                                self.face_num)
+        return False
+
+
+class PhaseProfiler():
+    enabled = True
+
+    def __init__(self, log_path=None):
+        self.log_path = log_path
+        # Phase name -> [seconds, calls, faces], in the order phases first ran
+        self.records = OrderedDict()
+        resetPeakRss()
+
+    def phase(self, name, face_num=0):
+        return PhaseTimer(self, name, face_num)
+
+    def addRecord(self, name, seconds, face_num):
+        record = self.records.get(name)
+        if record is None:
+            record = [0.0, 0, 0]
+            self.records[name] = record
+        record[0] += seconds
+        record[1] += 1
+        record[2] += int(face_num)
+
+    def totalSeconds(self):
+        return sum(record[0] for record in self.records.values())
+
+    def summary(self):
+        phases = ["%s %.3fs" % (name, record[0]) for name, record in self.records.items()]
+        return ", ".join(phases + ["peak RSS %s" % formatBytes(peakRss())])
+
+    def toDict(self, **info):
+        run = OrderedDict()
+        run["time"] = time.time()
+        run.update(info)
+        run["total_seconds"] = self.totalSeconds()
+        run["peak_rss"] = peakRss()
+        run["phases"] = OrderedDict((name, {"seconds": record[0],
+                                            "calls": record[1],
+                                            "faces": record[2]})
+                                    for name, record in self.records.items())
+        return run
+
+    def writeLog(self, **info):
+        # One JSON object per run appended to the log file
+        if not self.log_path:
+            return
+        with open(self.log_path, "a") as log_file:
+            log_file.write(json.dumps(self.toDict(**info)) + "\n")
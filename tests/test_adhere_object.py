@@ -0,0 +1,239 @@
+############################################################################
+#
+# test_adhere_object.py
+#
+# Copyright (C) 2018 chaosdesk
+#
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.#
+#
+# ##### END GPL LICENSE BLOCK #####
+#
+############################################################################
+
+# Tests of AdhereProc on the stand-in bpy of the benchmark, run with pytest.
+
+import os
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import benchmark
+
+adhere_object = benchmark.loadAdhereObject()
+adhesion_core = adhere_object.adhesion_core
+bpy = adhere_object.bpy
+
+SELECTED = 30
+STREAM_SIZE = 7
+
+
+@pytest.fixture(autouse=True)
+def emptyScene():
+    if not isinstance(bpy.context.scene, benchmark.StandInScene):
+        pytest.skip("needs the stand-in bpy")
+    bpy.context.scene = benchmark.StandInScene()
+    del bpy.data.objects[:]
+    del bpy.data.meshes[:]
+    adhere_object.caches.source_cache.clear()
+
+
+def makeObjects(selected=SELECTED):
+    target = benchmark.makeGridMesh(100)
+    select = np.zeros(target.faceCount(), dtype=bool)
+    select[np.random.RandomState(0).permutation(target.faceCount())[:selected]] = True
+    transform = adhesion_core.Transform.fromEuler((1.0, 2.0, 3.0), (0.1, 0.2, 0.3),
+                                                  (1.0, 2.0, 1.0))
+    org_obj = benchmark.makeMeshObject(adhere_object, "Target", target, select,
+                                       transform.matrix)
+
+    source, source_select = benchmark.makeSourceMesh()
+    adh_obj = benchmark.makeMeshObject(adhere_object, "Source", source, source_select)
+    adh_obj.scale = (1.0, 0.5, 2.0)
+    return org_obj, adh_obj
+
+
+def expectedPlacements(org_obj, adh_obj, offset):
+    # The whole selection solved at once
+    org_faces = adhere_object.SelectionSnapshot(org_obj.data)
+    adh_faces = adhere_object.SelectionSnapshot(adh_obj.data)
+    transform = adhere_object.getTransform(org_obj)
+    return adhesion_core.solvePlacements(adh_faces.averageNormal(), adh_faces.centerPoint(),
+                                         adh_obj.scale,
+                                         transform.applyToNormals(org_faces.faceNormals()),
+                                         transform.applyToPoints(org_faces.centers), offset)
+
+
+def runMultiple(copy_option, stream_size=STREAM_SIZE, offset=(0.0, 0.0, 0.0), **options):
+    org_obj, adh_obj = makeObjects()
+    aobj = adhere_object.AdhereProc()
+    aobj.stream_size = stream_size
+    aobj.placement_log = []
+    for name, value in options.items():
+        setattr(aobj, name, value)
+
+    assert aobj.execMultipleAdhesion(org_obj, adh_obj, offset, copy_option) == 0
+    return org_obj, adh_obj, aobj
+
+
+def testMultipleAdhesionCopy():
+    offset = (0.0, 0.0, 0.1)
+    org_obj, adh_obj, aobj = runMultiple("COPY", offset=offset)
+    placements = expectedPlacements(org_obj, adh_obj, offset)
+
+    assert len(aobj.copy_objs) == SELECTED
+    assert all(obj in bpy.context.scene.objects for obj in aobj.copy_objs)
+    assert all(obj.data is not adh_obj.data for obj in aobj.copy_objs)
+    assert np.allclose([obj.location for obj in aobj.copy_objs], placements.locations)
+    assert np.allclose([obj.delta_location for obj in aobj.copy_objs], placements.offsets)
+    assert np.allclose([obj.rotation_euler for obj in aobj.copy_objs], placements.eulers())
+    assert len(aobj.placement_log) == -(-SELECTED // STREAM_SIZE)
+
+
+def testMultipleAdhesionInstance():
+    org_obj, adh_obj, aobj = runMultiple("INSTANCE")
+    placements = expectedPlacements(org_obj, adh_obj, (0.0, 0.0, 0.0))
+
+    # One carrier with a face per copy, over all the chunks
+    assert len(aobj.copy_objs) == 1
+    carrier = aobj.copy_objs[0]
+    assert carrier.dupli_type == 'FACES'
+    assert len(carrier.data.polygons) == SELECTED
+    assert np.allclose(carrier.data.polygons.attributes["center"], placements.worldLocations())
+    assert [obj.parent for obj in bpy.context.scene.objects] == [None, carrier]
+
+
+def testMultipleAdhesionMerge():
+    org_obj, adh_obj, aobj = runMultiple("MERGE")
+    placements = expectedPlacements(org_obj, adh_obj, (0.0, 0.0, 0.0))
+    source, source_select = benchmark.makeSourceMesh()
+
+    assert len(aobj.copy_objs) == 1
+    merged_mesh = aobj.copy_objs[0].data
+    assert len(merged_mesh.polygons) == SELECTED * source.faceCount()
+    assert np.allclose(merged_mesh.vertices.attributes["co"].reshape(SELECTED, -1, 3),
+                       adhesion_core.placePoints(placements, source.verts, adh_obj.scale))
+
+
+def testMultipleAdhesionNone():
+    org_obj, adh_obj, aobj = runMultiple("NONE")
+    placements = expectedPlacements(org_obj, adh_obj, (0.0, 0.0, 0.0))
+    logged = adhesion_core.concatPlacements([chunk for name, chunk in aobj.placement_log])
+
+    assert len(bpy.context.scene.objects) == 0
+    assert aobj.copy_objs == []
+    assert [chunk.count() for name, chunk in aobj.placement_log] == [7, 7, 7, 7, 2]
+    assert logged.faces.tolist() == \
+        adhere_object.SelectionSnapshot(org_obj.data).indices.tolist()
+    assert np.allclose(logged.quats, placements.quats)
+    assert np.allclose(logged.locations, placements.locations)
+
+
+def testChunkedTangentsMatchWholeSelection():
+    for orient_option in ("LONGEST_EDGE", "FIRST_EDGE", "WORLD_Z"):
+        chunked = runMultiple("NONE", orient_option=orient_option)[2]
+        whole = runMultiple("NONE", stream_size=1000, orient_option=orient_option)[2]
+        chunked_quats = np.concatenate([chunk.quats for name, chunk in chunked.placement_log])
+
+        assert np.allclose(chunked_quats, whole.placement_log[0][1].quats)
+
+
+def testChunkedCullingMatchesWholeSelection():
+    chunked = runMultiple("NONE", cull_spacing=3.0)[2]
+    whole = runMultiple("NONE", stream_size=1000, cull_spacing=3.0)[2]
+
+    assert chunked.culled_num == whole.culled_num > 0
+    assert np.concatenate([chunk.faces for name, chunk in chunked.placement_log]).tolist() == \
+        whole.placement_log[0][1].faces.tolist()
+
+
+def testMultipleAdhesionInSteps():
+    # Solving and culling wait for the caller as well as the creation
+    org_obj, adh_obj, aobj = runMultiple("COPY", cull_spacing=3.0, chunk_size=3)
+    assert aobj.placement_log == [] and aobj.culled_num == 0 and aobj.copy_objs == []
+
+    progress = list(aobj.pending)
+    whole = runMultiple("COPY", cull_spacing=3.0)[2]
+    assert progress[-1] == (len(whole.copy_objs), len(whole.copy_objs))
+    assert all(done <= total for done, total in progress)
+    assert aobj.culled_num == whole.culled_num > 0
+    assert np.allclose([obj.location for obj in aobj.copy_objs],
+                       [obj.location for obj in whole.copy_objs])
+
+
+def testRunTwice():
+    # Copies and the culler grid of the first run don't carry over
+    org_obj, adh_obj, aobj = runMultiple("COPY", cull_spacing=0.5)
+    first_copies = list(aobj.copy_objs)
+    assert aobj.execMultipleAdhesion(org_obj, adh_obj, (0.0, 0.0, 0.0), "COPY") == 0
+
+    assert aobj.culled_num == 0
+    assert len(aobj.copy_objs) == aobj.copy_total == SELECTED
+    assert not set(aobj.copy_objs) & set(first_copies)
+    assert len(aobj.placement_log) == -(-SELECTED // STREAM_SIZE)
+
+
+def materialSlots(*names):
+    return [SimpleNamespace(material=SimpleNamespace(name=name)) for name in names]
+
+
+def testMultiAdhesionByMaterial():
+    org_obj, adh_obj = makeObjects()
+    org_obj.material_slots = materialSlots("Red")
+    adh_obj.material_slots = materialSlots("Blue")
+    aobj = adhere_object.AdhereProc()
+    assert aobj.execMultiAdhesion([org_obj], [adh_obj], (0.0, 0.0, 0.0), "COPY",
+                                  "MATERIAL", 0) == -3
+    assert aobj.copy_objs == []
+
+    adh_obj.material_slots = materialSlots("Blue", "Red")
+    assert aobj.execMultiAdhesion([org_obj], [adh_obj], (0.0, 0.0, 0.0), "COPY",
+                                  "MATERIAL", 0) == 0
+    assert len(aobj.copy_objs) == SELECTED
+
+
+def testMissingSelection():
+    org_obj, adh_obj = makeObjects()
+    adh_obj.data.polygons.foreach_set("select", np.zeros(6, dtype=bool))
+    assert adhere_object.AdhereProc().execMultipleAdhesion(org_obj, adh_obj, (0.0, 0.0, 0.0),
+                                                           "COPY") == -2
+
+    org_obj, adh_obj = makeObjects(selected=0)
+    assert adhere_object.AdhereProc().execMultipleAdhesion(org_obj, adh_obj, (0.0, 0.0, 0.0),
+                                                           "COPY") == -1
+
+
+def testSourceCacheFollowsSelection():
+    org_obj, adh_obj = makeObjects()
+    normal = adhere_object.AdhereProc().getSource(adh_obj).snapshot.averageNormal()
+    assert adhere_object.AdhereProc().getSource(adh_obj).snapshot.averageNormal() is normal
+
+    # Another face with the same selected count
+    select = np.zeros(6, dtype=bool)
+    select[1] = True
+    adh_obj.data.polygons.foreach_set("select", select)
+    assert np.allclose(adhere_object.AdhereProc().getSource(adh_obj).snapshot.averageNormal(),
+                       -normal)
+
+    # Moved vertices with the same selection
+    coords = adh_obj.data.vertices.attributes["co"] * 2.0
+    adh_obj.data.vertices.foreach_set("co", coords.ravel())
+    adh_obj.data.update()
+    assert np.allclose(adhere_object.AdhereProc().getSource(adh_obj).snapshot.centerPoint(),
+                       (1.0, 1.0, 2.0))
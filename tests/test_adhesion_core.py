@@ -0,0 +1,280 @@
+############################################################################
+#
+# test_adhesion_core.py
+#
+# Copyright (C) 2018 chaosdesk
+#
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.#
+#
+# ##### END GPL LICENSE BLOCK #####
+#
+############################################################################
+
+# Tests of the bpy independent adhesion geometry, run with pytest.
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import adhesion_core
+
+
+def randomQuaternions(count, seed=0):
+    quats = np.random.RandomState(seed).normal(size=(count, 4))
+    return adhesion_core.normalizeRows(quats)
+
+
+def sameRotations(quats_a, quats_b):
+    # q and -q are the same rotation
+    return np.allclose(np.abs((quats_a * quats_b).sum(axis=1)), 1.0)
+
+
+def testQuaternionMatrixRoundTrip():
+    quats = randomQuaternions(1000)
+    mats = adhesion_core.quaternionToMatrix(quats)
+
+    assert np.allclose(np.matmul(mats, mats.transpose(0, 2, 1)), np.identity(3))
+    assert np.allclose(np.linalg.det(mats), 1.0)
+    assert sameRotations(adhesion_core.matrixToQuaternion(mats), quats)
+
+
+def testMatrixToQuaternionHalfTurns():
+    # The w component is zero, so the signs come from the other components
+    mats = [np.diag((1.0, -1.0, -1.0)), np.diag((-1.0, 1.0, -1.0)), np.diag((-1.0, -1.0, 1.0))]
+    quats = adhesion_core.matrixToQuaternion(mats)
+
+    assert np.allclose(adhesion_core.quaternionToMatrix(quats), mats)
+
+
+def testQuaternionEulerRoundTrip():
+    quats = randomQuaternions(1000, seed=1)
+    eulers = adhesion_core.quaternionToEuler(quats)
+    mats = adhesion_core.quaternionToMatrix(quats)
+
+    for euler, mat in zip(eulers, mats):
+        assert np.allclose(adhesion_core.eulerToMatrix(euler), mat)
+
+
+def testRotateByQuaternionMatchesMatrix():
+    quats = randomQuaternions(100, seed=2)
+    vecs = np.random.RandomState(3).normal(size=(100, 3))
+    mats = adhesion_core.quaternionToMatrix(quats)
+
+    assert np.allclose(adhesion_core.rotateByQuaternion(quats, vecs),
+                       np.matmul(mats, vecs[:, :, np.newaxis])[:, :, 0])
+
+
+def testRotationDifference():
+    vec_from = np.array((0.3, -0.2, 0.9))
+    vecs_to = np.random.RandomState(4).normal(size=(100, 3))
+    quats = adhesion_core.rotationDifference(vec_from, vecs_to)
+    rotated = adhesion_core.rotateByQuaternion(quats, np.tile(vec_from, (100, 1)))
+
+    assert np.allclose(adhesion_core.normalizeRows(rotated),
+                       adhesion_core.normalizeRows(vecs_to))
+
+
+def testRotationDifferenceOpposite():
+    for vec_from in ((0.0, 0.0, 1.0), (1.0, 0.0, 0.0), (0.4, -0.5, 0.2)):
+        vec_from = np.array(vec_from)
+        quats = adhesion_core.rotationDifference(vec_from, -vec_from[np.newaxis])
+        rotated = adhesion_core.rotateByQuaternion(quats, vec_from[np.newaxis])
+
+        assert np.allclose(np.linalg.norm(quats, axis=1), 1.0)
+        assert np.allclose(rotated, -vec_from)
+
+
+def testRotationDifferenceZeroVector():
+    quats = adhesion_core.rotationDifference(np.zeros(3), np.ones((3, 3)))
+
+    assert np.allclose(quats, (1.0, 0.0, 0.0, 0.0))
+
+
+def testSolvePlacementsNonUniformScale():
+    src_normal = adhesion_core.normalizeRows(np.array([(0.2, 0.3, -1.0)]))[0]
+    src_center = np.array((0.5, -0.2, 0.1))
+    src_scale = np.array((1.0, 3.0, 0.5))
+    dst_normals = adhesion_core.normalizeRows(np.random.RandomState(5).normal(size=(50, 3)))
+    dst_centers = np.random.RandomState(6).normal(size=(50, 3))
+    offset = (0.0, 0.0, 0.25)
+    placements = adhesion_core.solvePlacements(src_normal, src_center, src_scale,
+                                               dst_normals, dst_centers, offset)
+
+    # The scaled and rotated selection center lands on each face center
+    centers = adhesion_core.placePoints(placements, [src_center], src_scale)[:, 0]
+    assert np.allclose(centers, dst_centers)
+
+    # Normals transform by the inverse scale, and then face the target
+    world_normals = adhesion_core.rotateByQuaternion(placements.quats,
+                                                     np.tile(src_normal / src_scale, (50, 1)))
+    assert np.allclose(adhesion_core.normalizeRows(world_normals), -dst_normals)
+
+    # The offset is in the rotated space of each copy
+    assert np.allclose(placements.offsets,
+                       adhesion_core.rotateByQuaternion(placements.quats,
+                                                        np.tile(offset, (50, 1))))
+    assert np.allclose(placements.worldLocations(), placements.locations + placements.offsets)
+
+
+def testSolveFramePlacementsFollowsTangents():
+    src_scale = np.array((2.0, 1.0, 1.0))
+    dst_normals = adhesion_core.normalizeRows(np.random.RandomState(7).normal(size=(50, 3)))
+    dst_tangents = np.random.RandomState(8).normal(size=(50, 3))
+    placements = adhesion_core.solveFramePlacements((0.0, 0.0, -1.0), (1.0, 0.0, 0.0),
+                                                    (0.0, 0.0, 0.0), src_scale, dst_normals,
+                                                    dst_tangents, np.zeros((50, 3)),
+                                                    (0.0, 0.0, 0.0))
+    mats = adhesion_core.quaternionToMatrix(placements.quats)
+    frames = adhesion_core.orthoFrames(dst_normals, dst_tangents)
+
+    assert np.allclose(mats[:, :, 2], dst_normals)
+    assert np.allclose(mats[:, :, 0], frames[:, :, 1])
+
+
+def childWorldMatrices(parent_matrix, placements):
+    # World matrices of children placed by location, quaternion and delta location
+    mats = np.tile(np.identity(4), (placements.count(), 1, 1))
+    mats[:, :3, :3] = adhesion_core.quaternionToMatrix(placements.quats)
+    mats[:, :3, 3] = placements.worldLocations()
+    return np.matmul(parent_matrix, mats)
+
+
+def testToParentSpaceNonUniformScale():
+    # A parent turned about Z and scaled along its own Y, copies on +Z faces
+    parent = adhesion_core.Transform.fromEuler((1.0, -2.0, 0.5), (0.0, 0.0, 0.5),
+                                               (1.0, 3.0, 1.0)).matrix
+    dst_normals = np.tile((0.0, 0.0, 1.0), (20, 1))
+    dst_centers = np.random.RandomState(15).normal(size=(20, 3))
+    placements = adhesion_core.solvePlacements((0.0, 0.0, -1.0), (0.0, 0.0, 0.0),
+                                               (1.0, 1.0, 1.0), dst_normals, dst_centers,
+                                               (0.0, 0.0, 0.3))
+    world = childWorldMatrices(parent, placements.toParentSpace(parent))
+
+    assert np.allclose(world[:, :3, 3], placements.worldLocations())
+    assert np.allclose(adhesion_core.normalizeRows(world[:, :3, 2]), dst_normals)
+
+    # Only the rotation of the parent is taken off the copies
+    local = placements.toParentSpace(parent)
+    rotation = adhesion_core.eulerToMatrix(np.array((0.0, 0.0, 0.5)))
+    assert sameRotations(local.quats,
+                         adhesion_core.multiplyQuaternion(
+                             adhesion_core.matrixToQuaternion(rotation.T)[0], placements.quats))
+
+
+def testToParentSpaceUniformScale():
+    # With a uniform scale the world rotation of every copy is unchanged
+    parent = adhesion_core.Transform.fromEuler((0.5, 0.0, -1.0), (0.3, -0.7, 1.1),
+                                               (2.0, 2.0, 2.0)).matrix
+    placements = adhesion_core.Placements(randomQuaternions(20, seed=16),
+                                          np.random.RandomState(17).normal(size=(20, 3)),
+                                          np.random.RandomState(18).normal(size=(20, 3)))
+    world = childWorldMatrices(parent, placements.toParentSpace(parent))
+
+    assert np.allclose(world[:, :3, 3], placements.worldLocations())
+    assert np.allclose(world[:, :3, :3] / 2.0, adhesion_core.quaternionToMatrix(placements.quats))
+
+
+def makeQuadStrip(quad_num, gap_after=None):
+    # Quads along X sharing edges, with a break after quad gap_after
+    verts = []
+    loop_verts = []
+    for i in range(0, quad_num):
+        shift = 1.0 if gap_after is not None and i > gap_after else 0.0
+        base = len(verts)
+        verts += [(i + shift, 0.0, 0.0), (i + 1 + shift, 0.0, 0.0),
+                  (i + 1 + shift, 1.0, 0.0), (i + shift, 1.0, 0.0)]
+        loop_verts += [base, base + 1, base + 2, base + 3]
+    mesh = adhesion_core.MeshArrays(verts, loop_verts, np.arange(0, quad_num * 4, 4),
+                                    np.full(quad_num, 4))
+
+    # Merge the duplicated corners of touching quads
+    keys = [tuple(vert) for vert in mesh.verts.tolist()]
+    unique = {}
+    index = np.array([unique.setdefault(key, len(unique)) for key in keys])
+    return adhesion_core.MeshArrays(sorted(unique, key=unique.get), index[mesh.loop_verts],
+                                    mesh.loop_start, mesh.loop_total)
+
+
+def testFaceIslands():
+    mesh = makeQuadStrip(6, gap_after=2)
+
+    assert mesh.faceIslands().tolist() == [0, 0, 0, 1, 1, 1]
+    assert makeQuadStrip(4).faceIslands().tolist() == [0, 0, 0, 0]
+
+
+def testFaceIslandsOfSubset():
+    # Faces of a subset are connected only through the faces it keeps
+    mesh = makeQuadStrip(5)
+
+    assert mesh.subset([0, 1, 3, 4]).faceIslands().tolist() == [0, 0, 1, 1]
+
+
+def cullBruteForce(points, spacing):
+    keep = np.zeros(len(points), dtype=bool)
+    for i, point in enumerate(points):
+        kept = points[keep]
+        keep[i] = len(kept) == 0 or np.linalg.norm(kept - point, axis=1).min() >= spacing
+    return keep
+
+
+def testOverlapCullerMatchesBruteForce():
+    points = np.random.RandomState(9).uniform(-5.0, 5.0, size=(2000, 3))
+    for spacing in (0.3, 1.0, 2.5):
+        keep = adhesion_core.OverlapCuller(spacing).cull(points)
+
+        assert keep.tolist() == cullBruteForce(points, spacing).tolist()
+
+
+def testOverlapCullerAcrossCalls():
+    # Points of earlier calls stay in the grid
+    points = np.random.RandomState(10).uniform(-5.0, 5.0, size=(1000, 3))
+    culler = adhesion_core.OverlapCuller(0.8)
+    keep = np.concatenate([culler.cull(chunk) for chunk in np.array_split(points, 7)])
+
+    assert keep.tolist() == cullBruteForce(points, 0.8).tolist()
+    assert adhesion_core.OverlapCuller(0.0).cull(points).all()
+
+
+def testTileMesh():
+    source = makeQuadStrip(2)
+    source.mat_index = np.array([0, 1])
+    source.uv_layers = [("UVMap", np.random.RandomState(11).uniform(size=(8, 2)))]
+    source.loop_normals = np.tile((0.0, 0.0, 1.0), (8, 1))
+    scale = (1.0, 2.0, 0.5)
+    placements = adhesion_core.Placements(randomQuaternions(3, seed=12),
+                                          np.random.RandomState(13).normal(size=(3, 3)),
+                                          np.random.RandomState(14).normal(size=(3, 3)))
+    tiles = adhesion_core.tileMesh(source, placements, scale)
+    vert_num = len(source.verts)
+
+    assert len(tiles.verts) == vert_num * 3
+    assert tiles.faceCount() == source.faceCount() * 3
+    assert np.allclose(tiles.verts.reshape(3, vert_num, 3),
+                       adhesion_core.placePoints(placements, source.verts, scale) +
+                       placements.offsets[:, np.newaxis, :])
+    assert tiles.loop_verts.tolist() == \
+        (source.loop_verts + np.arange(3)[:, np.newaxis] * vert_num).ravel().tolist()
+    assert tiles.loop_start.tolist() == list(range(0, 24, 4))
+    assert tiles.mat_index.tolist() == [0, 1] * 3
+    assert np.array_equal(tiles.uv_layers[0][1], np.tile(source.uv_layers[0][1], (3, 1)))
+
+    # Split normals turn with each copy
+    mats = adhesion_core.quaternionToMatrix(placements.quats)
+    assert np.allclose(tiles.loop_normals.reshape(3, 8, 3),
+                       np.repeat(mats[:, np.newaxis, :, 2], 8, axis=1))
@@ -0,0 +1,195 @@
+############################################################################
+#
+# test_mesh_io.py
+#
+# Copyright (C) 2018 chaosdesk
+#
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.#
+#
+# ##### END GPL LICENSE BLOCK #####
+#
+############################################################################
+
+# Tests of the OBJ and PLY files of the batch adhesion, run with pytest.
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import adhesion_core
+import batch_adhesion
+import mesh_io
+
+
+def makeMesh(faces, vert_num):
+    verts = np.random.RandomState(vert_num).uniform(-1.0, 1.0, size=(vert_num, 3))
+    loop_total = np.array([len(face) for face in faces])
+    loop_start = np.zeros(len(faces), dtype=np.int64)
+    np.cumsum(loop_total[:-1], out=loop_start[1:])
+    return adhesion_core.MeshArrays(verts, [index for face in faces for index in face],
+                                    loop_start, loop_total)
+
+
+def meshFaces(mesh_arrays):
+    return [mesh_arrays.loop_verts[start:start + total].tolist()
+            for start, total in zip(mesh_arrays.loop_start, mesh_arrays.loop_total)]
+
+
+def makePlacements(count):
+    random = np.random.RandomState(count)
+    quats = adhesion_core.normalizeRows(random.normal(size=(count, 4)))
+    return adhesion_core.Placements(quats, random.normal(size=(count, 3)),
+                                    random.normal(size=(count, 3)))
+
+
+def expectedTiles(base_mesh, src_mesh, placements, scale):
+    # Vertices and faces of the base mesh followed by one copy per placement
+    tiles = adhesion_core.tileMesh(src_mesh, placements, scale)
+    verts = np.concatenate((base_mesh.verts, tiles.verts))
+    faces = meshFaces(base_mesh) + [[index + len(base_mesh.verts) for index in face]
+                                    for face in meshFaces(tiles)]
+    return verts, faces
+
+
+QUADS = [[0, 1, 2, 3], [3, 2, 4, 5]]
+MIXED = [[0, 1, 2], [0, 2, 3, 4], [4, 3, 5]]
+
+
+@pytest.mark.parametrize("ext", [".obj", ".ply"])
+@pytest.mark.parametrize("src_faces", [QUADS, MIXED], ids=["quads", "mixed"])
+def testTilesRoundTrip(tmp_path, ext, src_faces):
+    # Mixed face sizes take the row by row fallback of binary PLY
+    filepath = str(tmp_path / ("tiles" + ext))
+    base_mesh = makeMesh([[0, 1, 2, 3]], 4)
+    src_mesh = makeMesh(src_faces, 6)
+    placements = makePlacements(5)
+    scale = (1.0, 2.0, 0.5)
+    mesh_io.writeTiles(filepath, src_mesh, placements, scale, base_mesh)
+    mesh_arrays = mesh_io.readMesh(filepath).mesh_arrays
+
+    verts, faces = expectedTiles(base_mesh, src_mesh, placements, scale)
+    assert np.allclose(mesh_arrays.verts, verts, atol=1e-5)
+    assert meshFaces(mesh_arrays) == faces
+
+
+def testTilesFromStream(tmp_path):
+    filepath = str(tmp_path / "stream.ply")
+    src_mesh = makeMesh(QUADS, 6)
+    placements = makePlacements(7)
+    stream = adhesion_core.PlacementStream(7, (placements.subset(slice(start, start + 3))
+                                               for start in range(0, 7, 3)))
+    mesh_io.writeTiles(filepath, src_mesh, stream, (1.0, 1.0, 1.0))
+
+    tiles = adhesion_core.tileMesh(src_mesh, placements, (1.0, 1.0, 1.0))
+    mesh_arrays = mesh_io.readMesh(filepath).mesh_arrays
+    assert np.allclose(mesh_arrays.verts, tiles.verts, atol=1e-5)
+    assert meshFaces(mesh_arrays) == meshFaces(tiles)
+
+
+def testReadObj(tmp_path):
+    filepath = str(tmp_path / "target.obj")
+    with open(filepath, "w") as obj_file:
+        obj_file.write("# comment\n"
+                       "o Plate\n"
+                       "v 0 0 0\nv 1 0 0\nv 1 1 0\nv 0 1 0\n"
+                       "vt 0 0\nvn 0 0 1\n"
+                       "usemtl Steel\n"
+                       "f 1/1/1 2/1/1 3/1/1 4/1/1\n"
+                       "g Bolts\n"
+                       "v 0 0 1\nv 1 0 1\nv 1 1 1\n"
+                       "usemtl Brass\n"
+                       "f -3 -2 -1\n"
+                       "usemtl Steel\n"
+                       "f 5//1 6//1 7//1\n")
+    mesh_file = mesh_io.readMesh(filepath)
+
+    assert len(mesh_file.mesh_arrays.verts) == 7
+    assert meshFaces(mesh_file.mesh_arrays) == [[0, 1, 2, 3], [4, 5, 6], [4, 5, 6]]
+    assert mesh_file.selectByMaterial("Steel").tolist() == [True, False, True]
+    assert mesh_file.selectByGroup("Bolts").tolist() == [False, True, True]
+    with pytest.raises(ValueError, match="not found"):
+        mesh_file.selectByMaterial("Gold")
+
+
+def testReadPlyAscii(tmp_path):
+    filepath = str(tmp_path / "target.ply")
+    with open(filepath, "w") as ply_file:
+        ply_file.write("ply\nformat ascii 1.0\ncomment made by hand\n"
+                       "element vertex 5\nproperty float x\nproperty float y\n"
+                       "property float z\nproperty uchar red\n"
+                       "element face 2\nproperty list uchar int vertex_indices\n"
+                       "end_header\n"
+                       "0 0 0 255\n1 0 0 255\n1 1 0 255\n0 1 0 255\n2 0 0 255\n"
+                       "4 0 1 2 3\n3 1 4 2\n")
+    mesh_arrays = mesh_io.readMesh(filepath).mesh_arrays
+
+    assert np.allclose(mesh_arrays.verts[4], (2.0, 0.0, 0.0))
+    assert meshFaces(mesh_arrays) == [[0, 1, 2, 3], [1, 4, 2]]
+
+
+def testReadPlyBigEndian(tmp_path):
+    filepath = str(tmp_path / "target.ply")
+    verts = np.array([(0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0)], dtype=">f8")
+    faces = np.zeros(2, dtype=[("count", "u1"), ("items", ">u2", (3,))])
+    faces["count"] = 3
+    faces["items"] = [(0, 1, 2), (0, 2, 3)]
+    with open(filepath, "wb") as ply_file:
+        ply_file.write(b"ply\nformat binary_big_endian 1.0\n"
+                       b"element vertex 4\nproperty double x\nproperty double y\n"
+                       b"property double z\n"
+                       b"element face 2\nproperty list uchar ushort vertex_indices\n"
+                       b"end_header\n")
+        ply_file.write(verts.tobytes())
+        ply_file.write(faces.tobytes())
+    mesh_arrays = mesh_io.readMesh(filepath).mesh_arrays
+
+    assert np.allclose(mesh_arrays.verts, verts)
+    assert meshFaces(mesh_arrays) == [[0, 1, 2], [0, 2, 3]]
+
+
+def testReadErrors(tmp_path):
+    filepath = str(tmp_path / "target.stl")
+    open(filepath, "w").close()
+    with pytest.raises(ValueError, match="unsupported mesh format"):
+        mesh_io.readMesh(filepath)
+
+    filepath = str(tmp_path / "target.ply")
+    with open(filepath, "w") as ply_file:
+        ply_file.write("solid\n")
+    with pytest.raises(ValueError, match="not a PLY file"):
+        mesh_io.readMesh(filepath)
+
+
+def testReadMask(tmp_path):
+    filepath = str(tmp_path / "mask.npy")
+    np.save(filepath, np.array([True, False, True, False]))
+    assert batch_adhesion.readMask(filepath, 4).tolist() == [True, False, True, False]
+    with pytest.raises(ValueError, match="mask has 4 entries, the mesh has 5 faces"):
+        batch_adhesion.readMask(filepath, 5)
+
+    np.save(filepath, np.array([3, 1]))
+    assert batch_adhesion.readMask(filepath, 4).tolist() == [False, True, False, True]
+
+    filepath = str(tmp_path / "mask.txt")
+    with open(filepath, "w") as mask_file:
+        mask_file.write("0 2\n3\n")
+    assert batch_adhesion.readMask(filepath, 4).tolist() == [True, False, True, True]
+    with pytest.raises(ValueError, match="face indices must be in 0 to 2"):
+        batch_adhesion.readMask(filepath, 3)
@@ -0,0 +1,124 @@
+############################################################################
+#
+# test_placement_io.py
+#
+# Copyright (C) 2018 chaosdesk
+#
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.#
+#
+# ##### END GPL LICENSE BLOCK #####
+#
+############################################################################
+
+# Tests of the placement file format, run with pytest.
+
+import os
+import struct
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import adhesion_core
+import placement_io
+
+
+def randomPlacements(count, seed, offsets=True):
+    random = np.random.RandomState(seed)
+    quats = adhesion_core.normalizeRows(random.normal(size=(count, 4)))
+    offset_rows = random.normal(size=(count, 3)) if offsets else None
+    return adhesion_core.Placements(quats, random.normal(size=(count, 3)), offset_rows)
+
+
+def testRoundTrip(tmp_path):
+    filepath = str(tmp_path / "copies.madp")
+    written = [("Rock", randomPlacements(5, 0)),
+               ("Grass", randomPlacements(7, 1, offsets=False)),
+               ("Rock", randomPlacements(3, 2)),
+               ("Tree", randomPlacements(0, 3))]
+    placement_io.writePlacements(filepath, written)
+    placement_file = placement_io.readPlacements(filepath)
+
+    assert isinstance(placement_file, placement_io.PlacementFile)
+    assert placement_file.source_names == ["Rock", "Grass", "Tree"]
+    assert placement_file.count() == 15
+    assert placement_file.sourceIds().tolist() == [0] * 5 + [1] * 7 + [0] * 3
+
+    rock = placement_file.placements(0)
+    rock_written = adhesion_core.concatPlacements([written[0][1], written[2][1]])
+    assert np.allclose(rock.quats, rock_written.quats, atol=1e-6)
+    assert np.allclose(rock.locations, rock_written.locations, atol=1e-6)
+    assert np.allclose(rock.offsets, rock_written.offsets, atol=1e-6)
+
+    # Records without offsets read back without them
+    grass = placement_file.placements(1)
+    assert grass.offsets is None
+    assert np.allclose(grass.locations, written[1][1].locations, atol=1e-6)
+    assert placement_file.placements(2).count() == 0
+    assert placement_file.placements().count() == 15
+
+
+def testEmptyFile(tmp_path):
+    filepath = str(tmp_path / "empty.madp")
+    placement_io.writePlacements(filepath, [])
+    placement_file = placement_io.PlacementFile(filepath)
+
+    assert placement_file.source_names == []
+    assert placement_file.count() == 0
+
+
+def rewriteHeader(filepath, **fields):
+    with open(filepath, "rb") as placement_file:
+        data = placement_file.read()
+    header = dict(zip(("magic", "version", "record_size", "count", "names_size", "reserved"),
+                      struct.unpack(placement_io.HEADER_FORMAT,
+                                    data[:placement_io.HEADER_SIZE])))
+    header.update(fields)
+    with open(filepath, "wb") as placement_file:
+        placement_file.write(struct.pack(placement_io.HEADER_FORMAT, header["magic"],
+                                         header["version"], header["record_size"],
+                                         header["count"], header["names_size"],
+                                         header["reserved"]))
+        placement_file.write(data[placement_io.HEADER_SIZE:])
+
+
+def testBadMagic(tmp_path):
+    filepath = str(tmp_path / "bad.madp")
+    placement_io.writePlacements(filepath, [("Rock", randomPlacements(2, 4))])
+    rewriteHeader(filepath, magic=b"NOTMADHP")
+    with pytest.raises(ValueError, match="not a placement file"):
+        placement_io.PlacementFile(filepath)
+
+    # Too short for a header
+    with open(filepath, "wb") as placement_file:
+        placement_file.write(placement_io.MAGIC)
+    with pytest.raises(ValueError, match="not a placement file"):
+        placement_io.PlacementFile(filepath)
+
+
+def testBadVersion(tmp_path):
+    filepath = str(tmp_path / "future.madp")
+    placement_io.writePlacements(filepath, [("Rock", randomPlacements(2, 5))])
+    rewriteHeader(filepath, version=placement_io.VERSION + 1)
+    with pytest.raises(ValueError, match="unsupported placement file version"):
+        placement_io.PlacementFile(filepath)
+
+    placement_io.writePlacements(filepath, [("Rock", randomPlacements(2, 5))])
+    rewriteHeader(filepath, record_size=placement_io.RECORD_DTYPE.itemsize + 4)
+    with pytest.raises(ValueError, match="unsupported placement file version"):
+        placement_io.PlacementFile(filepath)